@@ -0,0 +1,248 @@
+import xaeian as xn, utils, canon
+import os, io, json, time, bisect, hashlib, threading
+
+BACKUP_PATH = "./backups"
+COMPRESSIONS = ["none", "zlib", "lzma"]
+COMPRESSION = "zlib"
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+FIELDS = ["time", "digest", "size", "path"]
+
+# Codecs, 'csv' and 'tempfile' are imported on first use, a sync without backups never loads them
+
+def _Compressor(compression:str):
+  if compression == "zlib":
+    import zlib
+    return zlib.compressobj(6)
+  if compression == "lzma":
+    import lzma
+    return lzma.LZMACompressor()
+  return None
+
+def _Decompressor(compression:str):
+  if compression == "zlib":
+    import zlib
+    return zlib.decompressobj()
+  if compression == "lzma":
+    import lzma
+    return lzma.LZMADecompressor()
+  return None
+
+class _Decompressed(io.RawIOBase):
+  # Readable stream of an object file, whatever compression it was written with
+  def __init__(self, path:str):
+    self.file = open(path, "rb")
+    self.decompressor = _Decompressor(path.rsplit(".", 1)[1])
+    self.buffer = b""
+
+  def readable(self) -> bool:
+    return True
+
+  def readinto(self, buffer) -> int:
+    while not self.buffer:
+      chunk = self.file.read(utils.CHUNK_SIZE)
+      if not chunk: return 0
+      self.buffer = self.decompressor.decompress(chunk) if self.decompressor else chunk
+    size = min(len(buffer), len(self.buffer))
+    buffer[:size] = self.buffer[:size]
+    self.buffer = self.buffer[size:]
+    return size
+
+  def close(self):
+    self.file.close()
+    super().close()
+
+def IsDelta(path:str) -> bool:
+  return ".delta." in os.path.basename(path)
+
+class Store():
+  # Content-addressed backups: 'objects/<ab>/<digest>.<compression>' stored once per content,
+  # 'index.csv' records every (time, digest, size, path) backup in append order.
+  # Large files are kept as reverse deltas 'objects/<ab>/<digest>.delta.<compression>' against the
+  # newer version that replaced them, which is itself kept whole.
+  def __init__(self, path:str=BACKUP_PATH, compression:str|None=None):
+    self.path = xn.FixPath(path)
+    self.compression = compression or COMPRESSION
+    self.index_path = f"{self.path}/index.csv"
+    self.rows:list[dict]|None = None
+    self.paths:dict[str, list[dict]] = {}
+    self.lock = threading.Lock() # one backup written at a time, scan workers of several devices share the store
+    self.folders:set[str] = set() # object folders with renames not yet synced
+
+  def Index(self) -> list[dict]:
+    if self.rows is None:
+      import csv
+      rows = []
+      if os.path.isfile(self.index_path):
+        with open(self.index_path, "r", newline="", encoding="utf-8") as file:
+          rows = list(csv.DictReader(file))
+      self.Load(rows)
+    return self.rows
+
+  def Load(self, rows:list[dict]):
+    self.rows = rows
+    self.paths = {}
+    for row in rows: self.paths.setdefault(canon.Key(row["path"]), []).append(row)
+
+  def Object(self, digest:str) -> str|None:
+    # Existing object file for the digest, whatever compression it was written with
+    for kind in ("", "delta."):
+      for compression in COMPRESSIONS:
+        path = f"{self.path}/objects/{digest[:2]}/{digest}.{kind}{compression}"
+        if os.path.isfile(path): return path
+    return None
+
+  def _Write(self, digest:str, kind:str, fill) -> bool:
+    # 'fill(write)' streams the object content through the compressor, a false result discards it
+    folder = f"{self.path}/objects/{digest[:2]}"
+    os.makedirs(folder, exist_ok=True)
+    tmp = f"{folder}/{digest}.tmp"
+    compressor = _Compressor(self.compression)
+    with open(tmp, "wb") as out:
+      ok = fill(lambda data: out.write(compressor.compress(data) if compressor else data))
+      if compressor: out.write(compressor.flush())
+      if ok: os.fsync(out.fileno())
+    if not ok:
+      os.remove(tmp)
+      return False
+    os.replace(tmp, f"{folder}/{digest}.{kind}{self.compression}")
+    self.folders.add(folder) # under the lock of Add
+    return True
+
+  def _Full(self, src:str, digest:str, verify:bool=False) -> bool:
+    # Whole object of the content, replacing a delta object of it. With 'verify' the file must still
+    # have that digest, a base stored under a wrong digest would corrupt every delta against it
+    current = self.Object(digest)
+    if current and not IsDelta(current): return True
+    def Fill(write):
+      hasher = hashlib.new(utils.HASH_ALGORITHM)
+      with open(src, "rb") as file:
+        while chunk := file.read(utils.CHUNK_SIZE):
+          if verify: hasher.update(chunk)
+          write(chunk)
+      return not verify or hasher.hexdigest() == digest
+    if not self._Write(digest, "", Fill): return False
+    if current: os.remove(current)
+    return True
+
+  def _Delta(self, src:str, digest:str, base:str, base_digest:str|None=None) -> bool:
+    import delta
+    signature = delta.Signature(base)
+    if signature.digest == digest or (base_digest and signature.digest != base_digest): return False
+    if not self._Full(base, signature.digest, verify=True): return False
+    def Fill(write):
+      write(json.dumps({"base": signature.digest}).encode() + b"\n")
+      return delta.Encode(signature, src, write) == digest
+    return self._Write(digest, "delta.", Fill)
+
+  def Add(self, src:str, digest:str|None=None, base:str|None=None, base_digest:str|None=None) -> str:
+    # With 'base' (the copy replacing 'src') a large file is kept as a reverse delta against it,
+    # a whole object of the same content stored by an earlier run is converted too
+    digest = digest or utils.HashFile(src)
+    with self.lock:
+      rows = self.Index()
+      os.makedirs(self.path, exist_ok=True)
+      current = self.Object(digest)
+      if current and IsDelta(current): pass
+      elif base and os.path.getsize(src) >= utils.DELTA_SIZE and self._Delta(src, digest, base, base_digest):
+        if current: os.remove(current)
+      elif not current: self._Full(src, digest)
+      import csv
+      row = {"time": time.strftime(TIME_FORMAT), "digest": digest, "size": os.path.getsize(src), "path": canon.Real(src)}
+      new = not os.path.isfile(self.index_path)
+      with open(self.index_path, "a", newline="", encoding="utf-8") as file:
+        writer = csv.DictWriter(file, fieldnames=FIELDS)
+        if new: writer.writeheader()
+        writer.writerow(row)
+      row = {key: str(value) for key, value in row.items()}
+      rows.append(row)
+      self.paths.setdefault(canon.Key(src), []).append(row)
+    return digest
+
+  def Sync(self):
+    # Index rows and objects added since the last call are on disk once it returns
+    with self.lock:
+      folders, self.folders = self.folders, set()
+      if os.path.isfile(self.index_path):
+        with open(self.index_path, "a") as file: os.fsync(file.fileno())
+    utils.SyncDirs(folders | {os.path.dirname(self.index_path), f"{self.path}/objects"})
+
+  def Find(self, path:str, time:str|None=None) -> dict|None:
+    # Latest backup of the path taken at or before the time (index rows are in time order)
+    self.Index()
+    rows = self.paths.get(canon.Key(path), [])
+    if time is None: return rows[-1] if rows else None
+    i = bisect.bisect_right([row["time"] for row in rows], time)
+    return rows[i - 1] if i else None
+
+  def _Header(self, path:str) -> dict:
+    with io.BufferedReader(_Decompressed(path)) as reader:
+      return json.loads(reader.readline())
+
+  def Extract(self, digest:str, out) -> bool:
+    # Writes the content to 'out', deltas are applied on top of their extracted base
+    path = self.Object(digest)
+    if not path: return False
+    with io.BufferedReader(_Decompressed(path)) as reader:
+      if not IsDelta(path):
+        while chunk := reader.read(utils.CHUNK_SIZE): out.write(chunk)
+        return True
+      import delta, tempfile
+      header = json.loads(reader.readline())
+      with tempfile.TemporaryFile() as base:
+        if not self.Extract(header["base"], base): return False
+        delta.Apply(reader.read, base, out.write)
+    return True
+
+  def Restore(self, row:dict, dst:str|None=None) -> bool:
+    dst = dst or row["path"]
+    tmp = f"{dst}.lipysync"
+    with open(tmp, "wb") as out:
+      ok = self.Extract(row["digest"], out)
+    if not ok:
+      os.remove(tmp)
+      return False
+    os.replace(tmp, dst)
+    return True
+
+  def Prune(self, days:int|None=None, keep:int|None=None) -> tuple[int, int]:
+    # Drops index rows older than 'days' or beyond the newest 'keep' per path, then unreferenced objects
+    rows = self.Index()
+    import csv
+    limit = time.strftime(TIME_FORMAT, time.localtime(time.time() - days * 86400)) if days is not None else ""
+    counts:dict[str, int] = {}
+    kept = []
+    for row in reversed(rows):
+      key = canon.Key(row["path"])
+      counts[key] = counts.get(key, 0) + 1
+      if row["time"] < limit: continue
+      if keep is not None and counts[key] > keep: continue
+      kept.append(row)
+    kept.reverse()
+    if os.path.isdir(self.path):
+      with open(f"{self.index_path}.tmp", "w", newline="", encoding="utf-8") as file:
+        writer = csv.DictWriter(file, fieldnames=FIELDS)
+        writer.writeheader()
+        writer.writerows(kept)
+      os.replace(f"{self.index_path}.tmp", self.index_path)
+    self.Load(kept)
+    digests = {row["digest"] for row in kept}
+    root = f"{self.path}/objects"
+    objects:dict[str, list[str]] = {}
+    for folder in os.listdir(root) if os.path.isdir(root) else []:
+      for name in os.listdir(f"{root}/{folder}"):
+        objects.setdefault(name.split(".", 1)[0], []).append(f"{root}/{folder}/{name}")
+    # Bases of kept deltas are kept too, down to the whole object
+    pending = list(digests)
+    while pending:
+      for path in objects.get(pending.pop(), []):
+        if not IsDelta(path): continue
+        base = self._Header(path)["base"]
+        if base not in digests:
+          digests.add(base)
+          pending.append(base)
+    removed = 0
+    for digest, paths in objects.items():
+      if digest in digests: continue
+      for path in paths: os.remove(path)
+      removed += len(paths)
+    return len(rows) - len(kept), removed
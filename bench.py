@@ -0,0 +1,305 @@
+import xaeian as xn, utils
+import os, sys, json, time, random, shutil, hashlib, argparse, tempfile, tracemalloc, subprocess
+try: import resource
+except ImportError: resource = None
+
+class Color(xn.Color): pass
+
+MB = 1024 * 1024
+
+def CreateFile(path:str, size:int):
+  with open(path, "wb") as file:
+    while size > 0:
+      file.write(os.urandom(min(size, MB)))
+      size -= MB
+
+def Measure(fn, *args) -> tuple[float, int]:
+  tracemalloc.start()
+  start = time.perf_counter()
+  fn(*args)
+  elapsed = time.perf_counter() - start
+  peak = tracemalloc.get_traced_memory()[1]
+  tracemalloc.stop()
+  return elapsed, peak
+
+def Print(name:str, size:int, elapsed:float, peak:int):
+  print(f"{name:<24} {Color.BLUE}{size / MB / elapsed:8.1f}{Color.END} MB/s  peak {Color.ORANGE}{peak / MB:8.2f}{Color.END} MB")
+
+def HashReadAll(path:str, algorithm:str="md5") -> str:
+  # Implementation before streaming, kept as the reference point
+  hasher = hashlib.new(algorithm)
+  with open(path, "rb") as file:
+    hasher.update(file.read())
+  return hasher.hexdigest()
+
+def BenchHash(size_mb:int):
+  size = size_mb * MB
+  with tempfile.TemporaryDirectory() as tmp:
+    path = f"{tmp}/hash.bin"
+    CreateFile(path, size)
+    utils.HashFile(path) # warm page cache
+    Print("read-all md5", size, *Measure(HashReadAll, path))
+    for algorithm in utils.HASH_ALGORITHMS:
+      Print(f"stream {algorithm}", size, *Measure(utils.HashFile, path, algorithm))
+
+def BenchCopy(size_mb:int, repeat:int):
+  size = size_mb * MB
+  with tempfile.TemporaryDirectory() as tmp:
+    src, dst = f"{tmp}/src.bin", f"{tmp}/dst.bin"
+    CreateFile(src, size)
+    CreateFile(dst, size)
+    with open(src, "rb") as fsrc, open(f"{tmp}/probe.bin", "wb") as fdst:
+      method = utils.CopyData(fsrc.fileno(), fdst.fileno(), size)
+    for name, fn in (("shutil.copyfile", shutil.copyfile), (f"OverwriteFile {method}", utils.OverwriteFile)):
+      elapsed = sum(Measure(fn, src, dst)[0] for _ in range(repeat)) / repeat
+      print(f"{name:<32} {Color.BLUE}{size / MB / elapsed:8.1f}{Color.END} MB/s  {Color.GREY}{elapsed * 1000:.1f} ms{Color.END}")
+
+def TextData(rnd:random.Random, size:int) -> bytes:
+  # Numbered source-like lines, compressible like the vendored files synchronized in practice
+  pool = [" ".join(rnd.choice(["int", "return", "value", "buffer", "if", "(", ")", "{", "}", "size", "+=", "0x1F", ";"]) for _ in range(rnd.randrange(3, 12))).encode() for _ in range(1000)]
+  lines, length = [], 0
+  while length < size:
+    lines.append(b"%08d %s\n" % (len(lines), pool[rnd.randrange(len(pool))]))
+    length += len(lines[-1])
+  return b"".join(lines)[:size]
+
+def BenchDelta(sizes_kb:list[int], versions:int, overhead:float):
+  # Full atomic copy and whole backup objects against in-place patch and reverse delta backups,
+  # over 'versions' successive syncs of a file edited in a few lines each time. Both modes compress
+  # one whole version per sync, so deltas save space rather than time: the first size from which
+  # the delta mode stores less within 'overhead' of the full mode time is a DELTA_SIZE candidate.
+  import backup
+  delta_size = utils.DELTA_SIZE
+  rnd = random.Random(1)
+  threshold = None
+  with tempfile.TemporaryDirectory() as tmp:
+    for size_kb in sizes_kb:
+      history = [TextData(rnd, size_kb * 1024)]
+      for _ in range(versions):
+        data = bytearray(history[-1])
+        for _ in range(3):
+          offset = rnd.randrange(len(data))
+          data[offset:offset] = b"edited line\n"
+        history.append(bytes(data))
+      src, dst = f"{tmp}/src.bin", f"{tmp}/dst.bin"
+      results = {}
+      for name, size in (("full", 1 << 62), ("delta", 0)):
+        utils.DELTA_SIZE = size
+        store = backup.Store(f"{tmp}/{name}")
+        with open(dst, "wb") as file: file.write(history[0])
+        copy = backup_time = 0.0
+        for data in history[1:]:
+          with open(src, "wb") as file: file.write(data)
+          start = time.perf_counter()
+          store.Add(dst, None, src)
+          backup_time += time.perf_counter() - start
+          start = time.perf_counter()
+          utils.OverwriteFile(src, dst)
+          copy += time.perf_counter() - start
+        stored = sum(os.path.getsize(f"{root}/{file}") for root, _, files in os.walk(f"{tmp}/{name}/objects") for file in files)
+        results[name] = (copy, backup_time, stored)
+        shutil.rmtree(f"{tmp}/{name}")
+      ratio = sum(results["delta"][:2]) / sum(results["full"][:2])
+      pays = ratio <= 1 + overhead and results["delta"][2] < results["full"][2]
+      threshold = (threshold or size_kb) if pays else None
+      print(f"{size_kb:>8} KB  " + "  ".join(f"{name} {Color.BLUE}{copy * 1000:8.1f}{Color.END} copy + {Color.BLUE}{backup_time * 1000:8.1f}{Color.END} backup ms {Color.GREY}{stored / 1024:8.1f} KB stored{Color.END}" for name, (copy, backup_time, stored) in results.items()) + f"  {Color.GREEN if pays else Color.GREY}{ratio:5.2f}x{Color.END}")
+  utils.DELTA_SIZE = delta_size
+  print(f"DELTA_SIZE candidate: {Color.YELLOW}{f"{threshold} KB" if threshold else "none"}{Color.END} {Color.GREY}(current {delta_size // 1024} KB){Color.END}")
+
+#------------------------------------------------------------------------------ Synthetic tree
+
+PHASES = {
+  "scan": [], # cold run: listing, stat and comparison without cache or state
+  "rescan": [], # warm run: the same report served from cache and state
+  "diff": ["-d", "1.1"],
+  "update": ["-u"]
+}
+METRICS = ["wall", "cpu", "rchar", "read_bytes", "syscr", "syscw", "max_rss_kb"]
+
+def RandomSize(rnd:random.Random, mean_kb:float) -> int:
+  # Log-normal spread, most files are small and a few are large
+  return max(1, int(rnd.lognormvariate(0, 1) * mean_kb * 1024 / 1.65))
+
+def CreateTree(root:str, libs:int, paths:int, folders:int, fanout:int, size_kb:float, divergent:float, seed:int) -> dict:
+  rnd = random.Random(seed)
+  projects = {f"p{i}": f"{root}/projects/p{i}" for i in range(paths)}
+  sync = []
+  def Write(copies:list[str], size:int):
+    data = rnd.randbytes(size)
+    changed = rnd.random() < divergent
+    for nbr, path in enumerate(copies):
+      os.makedirs(os.path.dirname(path), exist_ok=True)
+      content = data
+      if changed and nbr == len(copies) - 1: # newest copy differs, same size or grown
+        offset = rnd.randrange(size)
+        content = data[:offset] + b"#" + data[offset + 1:] if rnd.random() < 0.5 else data + b"#"
+      with open(path, "wb") as file: file.write(content)
+      if changed and nbr == len(copies) - 1:
+        stamp = time.time() + 60
+        os.utime(path, (stamp, stamp))
+    return changed
+  stats = {"files": 0, "bytes": 0, "divergent": 0}
+  for i in range(libs):
+    name = f"lib{i}.c"
+    size = RandomSize(rnd, size_kb)
+    stats["divergent"] += Write([f"{folder}/lib/{name}" for folder in projects.values()], size)
+    stats["files"] += paths
+    stats["bytes"] += paths * size
+    sync.append({"name": name, "paths": [f"{{{key}}}/lib/{{name}}" for key in projects]})
+  for i in range(folders):
+    name = f"pkg{i}"
+    for j in range(fanout):
+      size = RandomSize(rnd, size_kb)
+      sub = f"sub{j % max(1, int(fanout ** 0.5))}"
+      stats["divergent"] += Write([f"{folder}/{name}/{sub}/f{j}.c" for folder in projects.values()], size)
+      stats["files"] += paths
+      stats["bytes"] += paths * size
+    sync.append({"name": name, "paths": [f"{{{key}}}/{{name}}" for key in projects]})
+  xn.JSON.SavePretty(f"{root}/sync.json", sync)
+  xn.INI.Save(f"{root}/dict.ini", projects)
+  return stats
+
+def Child(output:str, argv:list[str]):
+  # Runs main.py in this process and dumps its resource usage at exit
+  import atexit
+  def Dump():
+    usage = {}
+    if resource:
+      rusage = resource.getrusage(resource.RUSAGE_SELF)
+      usage["cpu"] = rusage.ru_utime + rusage.ru_stime
+      usage["max_rss_kb"] = rusage.ru_maxrss
+    if os.path.isfile("/proc/self/io"):
+      with open("/proc/self/io") as file:
+        for line in file:
+          key, value = line.split(":")
+          if key in METRICS: usage[key] = int(value)
+    with open(output, "w") as file: json.dump(usage, file)
+  atexit.register(Dump)
+  sys.argv = ["main.py"] + argv
+  import runpy
+  runpy.run_path(os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py"), run_name="__main__")
+
+def RunPhase(root:str, argv:list[str]) -> dict:
+  output = f"{root}/usage.json"
+  start = time.perf_counter()
+  subprocess.run([sys.executable, os.path.abspath(__file__), "child", output, "-C", root] + argv, stdout=subprocess.DEVNULL)
+  usage = {"wall": time.perf_counter() - start}
+  if os.path.isfile(output): usage |= xn.JSON.Load(output)
+  return usage
+
+def BenchTree(args) -> dict:
+  params = {key: getattr(args, key) for key in ("libs", "paths", "folders", "fanout", "size", "divergent", "seed")}
+  with tempfile.TemporaryDirectory() as tmp:
+    root = tmp.replace("\\", "/")
+    tree = CreateTree(root, args.libs, args.paths, args.folders, args.fanout, args.size, args.divergent, args.seed)
+    print(f"Tree {Color.BLUE}{tree["files"]}{Color.END} files, {Color.BLUE}{tree["bytes"] / MB:.1f}{Color.END} MB, {Color.YELLOW}{tree["divergent"]}{Color.END} divergent")
+    phases = {}
+    for phase, argv in PHASES.items():
+      phases[phase] = RunPhase(root, argv)
+      print(f"{phase:<8} {Color.BLUE}{phases[phase]["wall"] * 1000:9.1f}{Color.END} ms  " + "  ".join(f"{key} {Color.GREY}{value:.3g}{Color.END}" for key, value in phases[phase].items() if key != "wall"))
+  return {"params": params, "tree": tree, "phases": phases}
+
+#------------------------------------------------------------------------------ Startup
+
+STARTUP = {
+  "version": ["-v"],
+  "sync": [], # unchanged config, the editor save and git hook case
+  "update": ["-u"]
+}
+STARTUP_REFERENCE = "import argparse, json, hashlib, threading, sqlite3" # stdlib imports timed as the unit of this machine
+STARTUP_RATIO = 3.0 # import time main.py may add to the bare interpreter, in reference units
+
+def ImportTime(argv:list[str]) -> dict[str, int]:
+  # Self import time in µs of every module loaded by a fresh interpreter, bytecode caching stays on
+  env = {key: value for key, value in os.environ.items() if key != "PYTHONDONTWRITEBYTECODE"}
+  run = subprocess.run([sys.executable, "-X", "importtime"] + argv, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+  modules = {}
+  for line in run.stderr.splitlines():
+    if not line.startswith("import time:"): continue
+    self_us, _, name = line[12:].split("|")
+    if self_us.strip().isdigit(): modules[name.strip()] = int(self_us)
+  return modules
+
+def BenchStartup(budget:float|None, ratio:float, repeat:int) -> bool:
+  # Import time of main.py beyond what the bare interpreter loads, best of 'repeat' cold processes per mode.
+  # Without an absolute 'budget' (ms) it is 'ratio' times the reference imports, so it follows the machine.
+  base = set(ImportTime(["-c", "pass"]))
+  if budget is None:
+    reference = min(sum(us for name, us in ImportTime(["-c", STARTUP_REFERENCE]).items() if name not in base) for _ in range(repeat)) / 1000
+    budget = ratio * reference
+    print(f"{"budget":<8} {Color.BLUE}{budget:7.1f}{Color.END} ms {Color.GREY}({ratio:g} x {reference:.1f} ms reference imports){Color.END}")
+  main = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+  over = False
+  with tempfile.TemporaryDirectory() as tmp:
+    root = tmp.replace("\\", "/")
+    CreateTree(root, 4, 2, 0, 0, 1, 0, 1)
+    for mode, argv in STARTUP.items():
+      runs = []
+      for _ in range(repeat):
+        start = time.perf_counter()
+        modules = ImportTime([main, "-C", root] + argv)
+        runs.append((time.perf_counter() - start, {name: us for name, us in modules.items() if name not in base}))
+      wall, modules = min(runs, key=lambda run: sum(run[1].values()))
+      total = sum(modules.values()) / 1000
+      over |= total > budget
+      color = Color.RED if total > budget else Color.GREEN
+      slowest = sorted(modules.items(), key=lambda item: item[1], reverse=True)[:5]
+      print(f"{mode:<8} {color}{total:7.1f}{Color.END} ms import  {Color.GREY}{wall * 1000:7.1f} ms wall{Color.END}  " + "  ".join(f"{name} {Color.GREY}{us / 1000:.1f}{Color.END}" for name, us in slowest))
+  return over
+
+def Compare(old_path:str, new_path:str, threshold:float):
+  old, new = xn.JSON.Load(old_path), xn.JSON.Load(new_path)
+  if old["params"] != new["params"]:
+    print(f"{Color.YELLOW}Runs use different tree parameters{Color.END}")
+  regression = False
+  for phase, metrics in new["phases"].items():
+    for key in METRICS:
+      if key not in metrics or not old["phases"].get(phase, {}).get(key): continue
+      ratio = metrics[key] / old["phases"][phase][key]
+      color = Color.RED if ratio > 1 + threshold else Color.GREEN if ratio < 1 - threshold else Color.GREY
+      regression |= ratio > 1 + threshold
+      print(f"{phase:<8} {key:<12} {old["phases"][phase][key]:>12.4g} -> {metrics[key]:<12.4g} {color}{ratio:6.2f}x{Color.END}")
+  return regression
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="LipySync benchmarks")
+  commands = parser.add_subparsers(dest="command", required=True)
+  hash_parser = commands.add_parser("hash", help="Throughput and peak memory of utils.HashFile")
+  hash_parser.add_argument("-s", "--size", type=int, default=256, help="Test file size in MB")
+  copy_parser = commands.add_parser("copy", help="shutil.copyfile against atomic utils.OverwriteFile")
+  copy_parser.add_argument("-s", "--size", type=int, default=256, help="Test file size in MB")
+  copy_parser.add_argument("-r", "--repeat", type=int, default=5, help="Copies averaged per method")
+  delta_parser = commands.add_parser("delta", help="Full copy & backup against in-place patch & reverse delta backup by file size")
+  delta_parser.add_argument("-s", "--sizes", type=int, nargs="+", default=[64, 256, 1024, 4096, 16384, 65536], help="File sizes in KB")
+  delta_parser.add_argument("-n", "--versions", type=int, default=4, help="Successive synced versions of each file")
+  delta_parser.add_argument("-t", "--overhead", type=float, default=0.25, help="Accepted relative time overhead of the delta mode")
+  tree_parser = commands.add_parser("tree", help="Scan, rescan, diff and update phases of main.py on a synthetic multi-project tree")
+  tree_parser.add_argument("-l", "--libs", type=int, default=200, help="File libraries")
+  tree_parser.add_argument("-p", "--paths", type=int, default=3, help="Copies of each library (projects)")
+  tree_parser.add_argument("-f", "--folders", type=int, default=5, help="Folder libraries")
+  tree_parser.add_argument("-n", "--fanout", type=int, default=100, help="Files in each folder library")
+  tree_parser.add_argument("-s", "--size", type=float, default=16, help="Mean file size in KB (log-normal)")
+  tree_parser.add_argument("-d", "--divergent", type=float, default=0.1, help="Fraction of files whose newest copy differs")
+  tree_parser.add_argument("--seed", type=int, default=1)
+  tree_parser.add_argument("-o", "--output", type=str, help="Save results as JSON")
+  compare_parser = commands.add_parser("compare", help="Compare two JSON results of 'tree'")
+  compare_parser.add_argument("old", type=str)
+  compare_parser.add_argument("new", type=str)
+  compare_parser.add_argument("-t", "--threshold", type=float, default=0.1, help="Relative change reported as regression")
+  startup_parser = commands.add_parser("startup", help="Import time of main.py modes, fails when one is over the budget")
+  startup_parser.add_argument("-b", "--budget", type=float, default=None, help="Absolute import time budget in ms (default: relative, see --ratio)")
+  startup_parser.add_argument("--ratio", type=float, default=STARTUP_RATIO, help=f"Budget as a multiple of the reference stdlib imports timed on this machine (default: {STARTUP_RATIO:g})")
+  startup_parser.add_argument("-r", "--repeat", type=int, default=5, help="Cold runs per mode, the fastest one counts")
+  child_parser = commands.add_parser("child")
+  child_parser.add_argument("output", type=str)
+  child_parser.add_argument("argv", nargs=argparse.REMAINDER)
+  args = parser.parse_args()
+  if args.command == "hash": BenchHash(args.size)
+  elif args.command == "copy": BenchCopy(args.size, args.repeat)
+  elif args.command == "delta": BenchDelta(args.sizes, args.versions, args.overhead)
+  elif args.command == "tree":
+    result = BenchTree(args)
+    if args.output: xn.JSON.SavePretty(os.path.abspath(args.output), result)
+  elif args.command == "compare": sys.exit(1 if Compare(os.path.abspath(args.old), os.path.abspath(args.new), args.threshold) else 0)
+  elif args.command == "startup": sys.exit(1 if BenchStartup(args.budget, args.ratio, args.repeat) else 0)
+  elif args.command == "child": Child(args.output, args.argv)
@@ -0,0 +1,27 @@
+import os, sys, functools
+
+CACHE_SIZE = 65536 # paths remembered by each memo, least recently used ones are dropped
+CASELESS = sys.platform in ("win32", "darwin") # default filesystems there ignore case
+
+# One spelling per file: every module keys paths by these memoized forms, so a path written with '..',
+# through a symlink or in another case is deduplicated, backed up and cached as the same file.
+
+@functools.lru_cache(CACHE_SIZE)
+def Normal(path:str) -> str:
+  # Absolute, '/' separated, without '.', '..' and doubled separators, no filesystem access
+  return os.path.abspath(path).replace("\\", "/")
+
+@functools.lru_cache(CACHE_SIZE)
+def Real(path:str) -> str:
+  # Normal path with symlinks resolved, missing parts are kept as written
+  return Normal(os.path.realpath(path))
+
+@functools.lru_cache(CACHE_SIZE)
+def Key(path:str) -> str:
+  # Real path for dictionary keys, case folded where the filesystem ignores case
+  path = Real(path)
+  return path.casefold() if CASELESS else path
+
+def Identity(stat:os.stat_result) -> tuple[int, int]:
+  # Physical file: same device and inode is the same file under any path (hard links too)
+  return stat.st_dev, stat.st_ino
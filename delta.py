@@ -0,0 +1,106 @@
+import utils
+import os, mmap, zlib, struct, hashlib
+
+BLOCK_SIZE = 4096
+ROLL_LIMIT = 1024 * 1024 # bytes searched one by one per delta, aligned blocks are still matched beyond it
+MOD = 65521 # Adler-32
+COPY = struct.Struct(">QQ") # b"C" offset, length: bytes taken from the basis
+DATA = struct.Struct(">Q") # b"D" length, data: literal bytes
+
+def _Strong(data:bytes) -> bytes:
+  return hashlib.blake2b(data, digest_size=16).digest()
+
+def Weak(data:bytes) -> tuple[int, int]:
+  # Adler-32 parts computed by zlib: a = 1 + sum of bytes, b = L + sum of (L - i) * byte
+  weak = zlib.adler32(data)
+  return weak & 0xFFFF, weak >> 16
+
+class Signature():
+  # Weak and strong checksums of every basis block, read in one pass with the digest of the whole file
+  def __init__(self, path:str, block:int=BLOCK_SIZE, algorithm:str|None=None):
+    self.block = block
+    self.strong:list[bytes] = []
+    self.weak:dict[int, list[int]] = {}
+    hasher = hashlib.new(algorithm or utils.HASH_ALGORITHM)
+    with open(path, "rb") as file:
+      while data := file.read(block):
+        hasher.update(data)
+        if len(data) == block:
+          a, b = Weak(data)
+          self.weak.setdefault(a | b << 16, []).append(len(self.strong))
+        self.strong.append(_Strong(data))
+        self.tail = len(data)
+    self.digest = hasher.hexdigest()
+
+def Encode(signature:Signature, path:str, write, algorithm:str|None=None, ratio:float=0.5) -> str|None:
+  # Writes copy and literal records rebuilding 'path' from the basis and returns the digest of 'path',
+  # None once literal data would exceed 'ratio' of the file (a full copy is the better choice then)
+  block, strong, weak = signature.block, signature.strong, signature.weak
+  with open(path, "rb") as file:
+    size = os.fstat(file.fileno()).st_size
+    if not size or not strong: return None
+    with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+      limit = int(size * ratio)
+      literal = rolled = hint = start = pos = 0
+      copy = None # pending [offset, length], merged while basis blocks follow each other
+      def Emit(index:int|None, length:int):
+        nonlocal copy, literal
+        if pos > start:
+          if copy: write(b"C" + COPY.pack(*copy))
+          copy = None
+          write(b"D" + DATA.pack(pos - start))
+          write(data[start:pos])
+          literal += pos - start
+        if index is None: return
+        if copy and copy[0] + copy[1] == index * block: copy[1] += length
+        else:
+          if copy: write(b"C" + COPY.pack(*copy))
+          copy = [index * block, length]
+      while pos + block <= size:
+        chunk = data[pos:pos + block]
+        # Next basis block first, then any block with the same weak checksum
+        index = hint if hint < len(strong) and strong[hint] == _Strong(chunk) else None
+        if index is None:
+          a, b = Weak(chunk)
+          while True:
+            for candidate in weak.get(a | b << 16, ()):
+              if strong[candidate] == _Strong(data[pos:pos + block]):
+                index = candidate
+                break
+            if index is not None or rolled >= ROLL_LIMIT or pos + block >= size: break
+            old, new = data[pos], data[pos + block]
+            a = (a - old + new) % MOD
+            b = (b - block * old + a - 1) % MOD
+            pos += 1
+            rolled += 1
+          if index is None:
+            pos += block if rolled >= ROLL_LIMIT else 1
+            if literal + pos - start > limit: return None
+            continue
+        Emit(index, block)
+        pos += block
+        start, hint = pos, index + 1
+      # Shorter last block only matches the basis tail
+      if size - pos == signature.tail < block and strong[-1] == _Strong(data[pos:]):
+        Emit(len(strong) - 1, size - pos)
+        pos = start = size
+      pos = size
+      Emit(None, 0)
+      if copy: write(b"C" + COPY.pack(*copy))
+      if literal > limit: return None
+      return hashlib.new(algorithm or utils.HASH_ALGORITHM, data).hexdigest()
+
+def Apply(read, basis, write):
+  # Rebuilds the file from records given by 'read' and the seekable 'basis' file
+  while kind := read(1):
+    if kind == b"C":
+      offset, length = COPY.unpack(read(COPY.size))
+      basis.seek(offset)
+    else:
+      length, = DATA.unpack(read(DATA.size))
+    source = basis.read if kind == b"C" else read
+    while length:
+      chunk = source(min(length, utils.CHUNK_SIZE))
+      if not chunk: raise EOFError("Truncated delta")
+      write(chunk)
+      length -= len(chunk)
@@ -0,0 +1,74 @@
+import os
+from concurrent.futures import ThreadPoolExecutor, Future
+
+KINDS = ["rotational", "network", "ssd"] # slowest first, a job runs on the pool of its slowest device
+NETWORK_FS = {"cifs", "smb3", "smbfs", "nfs", "nfs4", "9p", "afs", "ceph", "glusterfs", "davfs", "fuse.sshfs", "fuse.rclone"}
+NETWORK_JOBS = 32 # requests kept in flight to hide the round trip
+
+def Mounts() -> dict[int, str]:
+  # st_dev of every mount with its filesystem type, empty where '/proc' is missing
+  mounts = {}
+  try:
+    with open("/proc/self/mountinfo") as file:
+      for line in file:
+        fields = line.split()
+        major, minor = map(int, fields[2].split(":"))
+        mounts[os.makedev(major, minor)] = fields[fields.index("-") + 1]
+  except (OSError, ValueError, IndexError): pass
+  return mounts
+
+def Rotational(dev:int) -> bool|None:
+  # '/sys/dev/block/<major>:<minor>' is the disk or its partition, the queue belongs to the disk
+  base = f"/sys/dev/block/{os.major(dev)}:{os.minor(dev)}"
+  for path in (f"{base}/queue/rotational", f"{base}/../queue/rotational"):
+    try:
+      with open(path) as file: return file.read().strip() == "1"
+    except OSError: pass
+  return None
+
+def Detect(dev:int, mounts:dict[int, str]) -> str:
+  if mounts.get(dev) in NETWORK_FS: return "network"
+  return "rotational" if Rotational(dev) else "ssd"
+
+def Valid(value) -> bool:
+  # Config value: a kind or a worker count
+  return value in KINDS or (isinstance(value, int) and not isinstance(value, bool) and value > 0)
+
+class Scheduler():
+  # One worker pool per device (st_dev): a single worker taking jobs in inode order on rotational disks,
+  # 'jobs' workers on SSDs and NETWORK_JOBS on network mounts. 'overrides' maps a path on the device
+  # to its kind or worker count, anything not detected (other systems) counts as an SSD.
+  def __init__(self, jobs:int, overrides:dict[str, str|int]|None=None, stat=os.stat):
+    self.jobs = jobs
+    self.mounts = Mounts()
+    self.overrides = {}
+    for path, value in (overrides or {}).items():
+      if (path_stat := stat(path)) and Valid(value): self.overrides[path_stat.st_dev] = value
+    self.devices:dict[int, tuple[str, int]] = {}
+    self.counts:dict[int, int] = {}
+    self.pools:dict[int, ThreadPoolExecutor] = {}
+
+  def Device(self, dev:int) -> tuple[str, int]:
+    if dev not in self.devices:
+      override = self.overrides.get(dev)
+      kind = override if override in KINDS else Detect(dev, self.mounts)
+      limit = override if isinstance(override, int) else {"rotational": 1, "network": NETWORK_JOBS}.get(kind, self.jobs)
+      self.devices[dev] = (kind, limit)
+    return self.devices[dev]
+
+  def Place(self, stats:list[os.stat_result]) -> tuple[int, int]:
+    # Device whose pool runs the job and its rank there: inode on rotational disks, 0 elsewhere
+    dev, stat = min(((stat.st_dev, stat) for stat in stats), key=lambda item: (KINDS.index(self.Device(item[0])[0]), self.Device(item[0])[1], item[0]))
+    return dev, stat.st_ino if self.devices[dev][0] == "rotational" else 0
+
+  def Submit(self, dev:int, fn, *args) -> Future:
+    if dev not in self.pools:
+      self.pools[dev] = ThreadPoolExecutor(self.Device(dev)[1], thread_name_prefix=f"dev{os.major(dev)}:{os.minor(dev)}")
+    self.counts[dev] = self.counts.get(dev, 0) + 1
+    return self.pools[dev].submit(fn, *args)
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    for pool in self.pools.values(): pool.shutdown()
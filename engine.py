@@ -0,0 +1,428 @@
+import xaeian as xn, utils, backup, metrics, canon, loader, state, journal, index
+import os, time, itertools
+from typing import Iterator
+
+class Color(xn.Color): pass
+
+INLINE_JOBS = 16 # fewer scan jobs (hooks syncing a handful of files) are run without worker pools
+APPLY_BATCH = 256 # updates per journal step, their folders are synced once per step
+
+class SyncError(Exception):
+  # Config or run error that stops the sync, the message is ready to print
+  pass
+
+class Config():
+  # Libraries of 'sync.json' with the placeholders of 'dict.ini' expanded and paths normalized.
+  # A config without errors is cached as 'plan.json' and reused while both files are unchanged.
+  # 'issues' are the (level, message) found by validation: 'error' or 'warning'. Its stats are kept
+  # in 'snapshot' for the first scan of the engine, so a path is stated once per run.
+  def __init__(self, folder:str=""):
+    folder = self.folder = xn.FixPath(folder) # resolved once: config, plan, cache, state and backups sit together
+    self.issues:list[tuple[str, str]] = []
+    self.snapshot = utils.StatSnapshot()
+    with metrics.Phase("config"):
+      self.fingerprint = loader.Fingerprint([f"{folder}sync.json", f"{folder}dict.ini"])
+      plan = loader.LoadPlan(f"{folder}plan.json", self.fingerprint)
+      self.planned = plan is not None
+      if self.planned:
+        self.sync, self.devices = plan["sync"], plan["devices"]
+        return
+      self.sync = xn.JSON.Load(f"{folder}sync.json")
+      if not self.sync:
+        raise SyncError(f"Missing file or invalid config file {Color.RED}sync.json{Color.END}")
+      ini = xn.INI.Load(f"{folder}dict.ini")
+      mydict = loader.ResolveDict(ini)
+      self.devices = loader.Devices(ini.get("devices", {}), mydict)
+      for name, unknown in loader.ExpandSync(self.sync, mydict).items():
+        self.issues.append(("error", f"Unknown placeholder {Color.ORANGE}{", ".join(f"{{{key}}}" for key in sorted(unknown))}{Color.END} in library {Color.RED}{name}{Color.END}"))
+      for sy in self.sync:
+        sy["paths"] = [canon.Normal(xn.FixPath(path)) for path in sy["paths"] if not path.startswith("#")]
+    with metrics.Phase("validate"):
+      self.Validate()
+    if self.valid: loader.SavePlan(f"{folder}plan.json", self.fingerprint, self.sync, self.devices)
+
+  @property
+  def valid(self) -> bool:
+    return not any(level == "error" for level, _ in self.issues)
+
+  def Validate(self):
+    # Names & paths must be unique, a library holds files or folders (stored as 'file')
+    snapshot = self.snapshot
+    name_set = set()
+    for sy in self.sync:
+      if sy["name"] in name_set:
+        raise SyncError(f"Synchronized library name {Color.RED}{sy["name"]}{Color.END} is duplicated")
+      name_set.add(sy["name"])
+      path_set = set()
+      cnt_file = 0
+      cnt_dir = 0
+      for path in sy["paths"]:
+        if snapshot.IsFile(path): cnt_file += 1
+        elif snapshot.IsDir(path): cnt_dir += 1
+        else: self.issues.append(("error", f"Path {Color.ORANGE}{path}{Color.END} in library {Color.RED}{sy["name"]}{Color.END} doesn't exist"))
+        if canon.Key(path) in path_set: # also under another spelling (symlink, letter case)
+          raise SyncError(f"Path {Color.ORANGE}{path}{Color.END} in library {Color.RED}{sy["name"]}{Color.END} appears multiple times")
+        path_set.add(canon.Key(path))
+      if cnt_file and cnt_dir:
+        self.issues.append(("error", f"Library {Color.RED}{sy["name"]}{Color.END} contains files and folders paths"))
+      sy["file"] = True if cnt_file else False
+    # Physical paths shared by libraries: an error unless white/black lists may split their files
+    filtered = {sy["name"] for sy in self.sync if sy.get("whiteList") or sy.get("blackList")}
+    for kind, path, name, other, other_name in index.PathIndex(self.sync, None).Overlaps(snapshot.IsDir):
+      if kind == "nested":
+        self.issues.append(("warning", f"Path {Color.ORANGE}{path}{Color.END} in library {Color.YELLOW}{name}{Color.END} lies in folder {Color.GREY}{other}{Color.END} of library {Color.YELLOW}{other_name}{Color.END}"))
+      elif name in filtered or other_name in filtered:
+        self.issues.append(("warning", f"Path {Color.ORANGE}{path}{Color.END} in library {Color.YELLOW}{name}{Color.END} is also {Color.GREY}{other}{Color.END} in library {Color.YELLOW}{other_name}{Color.END}"))
+      else:
+        self.issues.append(("error", f"Path {Color.ORANGE}{path}{Color.END} in library {Color.RED}{name}{Color.END} is also {Color.GREY}{other}{Color.END} in library {Color.RED}{other_name}{Color.END}"))
+    import devices
+    for path, value in self.devices.items():
+      if not devices.Valid(value):
+        self.issues.append(("error", f"Device {Color.ORANGE}{path}{Color.END} setting {Color.RED}{value}{Color.END} isn't a kind ({", ".join(devices.KINDS)}) or a worker count"))
+
+class SyncEngine():
+  # Scan, plan, apply and diff of a loaded config, usable from other tools without a process per run.
+  # Hash cache, state (last syncs, folder listings) and backup store stay loaded between calls,
+  # a stat snapshot and the shared listings are only kept for one scan (the files may change meanwhile).
+  def __init__(self, config:Config, jobs:int|None=None, store:backup.Store|None=None, compression:str|None=None):
+    self.config = config
+    self.jobs = jobs or min(32, (os.cpu_count() or 1) + 4)
+    self.store = store or backup.Store(f"{config.folder}backups", compression)
+    self.cache = utils.HashCache(f"{config.folder}cache.json")
+    self.db = state.State(f"{config.folder}state.db")
+    self.wal = journal.Journal(f"{config.folder}journal.ndjson")
+    self.snapshot = config.snapshot # validation stats, reused by the first scan
+    self.fresh = True
+    self.libraries = index.PathIndex(config.sync, self.db.ListDir)
+    self.trees:list[tuple[str, list[tuple[str, str]]]] = [] # (library, [(path, Merkle root)]) of the last scan
+    self.leaves:dict[str, str] = {} # file digests of the Merkle trees, per scan
+    self.scheduler = None # device pools of the last scan, None when it ran inline
+    self.watcher = None # inotify of the library paths, set by Watch
+    self.remote:tuple[str, ...] = () # prefixes of the library paths on network mounts, stated every scan
+
+  def Select(self, only:list[str]|None=None, path:str|None=None) -> list[dict]:
+    # Libraries with names matching 'only' globs, then the library (or single file entry) owning 'path'
+    entries = self.config.sync
+    if only:
+      import fnmatch
+      entries = [sy for sy in entries if any(fnmatch.fnmatchcase(sy["name"], pattern) for pattern in only)]
+      if not entries: raise SyncError(f"No library matches {Color.RED}{", ".join(only)}{Color.END}")
+    if path:
+      path = canon.Normal(path)
+      entry = self.libraries.Lookup(path) or self.libraries.Lookup(canon.Real(path))
+      if not entry or not any(entry.get("library", entry["name"]) == sy["name"] for sy in entries):
+        raise SyncError(f"Path {Color.ORANGE}{path}{Color.END} isn't synchronized by {"any selected" if only else "any"} library")
+      entries = [entry]
+    return entries
+
+  def _FileJob(self, name:str, paths:list[str], must_exist:bool=True) -> tuple[str, list[str]]:
+    if must_exist:
+      missing = [file for file in paths if not self.snapshot.IsFile(file)]
+      if missing: raise SyncError(f"Missing {Color.RED}{name}{Color.END} file: {Color.ORANGE}{missing[0]}{Color.END}")
+    else:
+      paths = [file for file in paths if self.snapshot.IsFile(file)]
+    return name, paths
+
+  def _FolderJobs(self, name:str, paths:list[str], whitelist:list[str]|None, blacklist:list[str], full:bool):
+    # Folder copies are compared as Merkle trees: equal roots end the library, otherwise only subtrees
+    # whose nodes differ are descended into. Leaves missing in the hash cache are hashed on the device pools first.
+    whitelist, blacklist = utils.CompileGlobs(whitelist), utils.CompileGlobs(blacklist)
+    try:
+      for path in paths: utils.FileList(path) # checks only, the trees list the folders
+    except Exception as e:
+      raise SyncError(str(e))
+    import merkle
+    trees = [merkle.Tree(path, whitelist, blacklist, self.libraries.ListDir, self._Digest) for path in paths]
+    with metrics.Phase("merkle"):
+      self._Leaves(trees)
+      roots = [tree.Node() for tree in trees]
+    self.trees.append((name, list(zip(paths, roots))))
+    yield from self._Subtree(name, trees, "", full)
+
+  def _Leaves(self, trees:list):
+    # Digests of all tree files: cached ones are taken as they are, the others are hashed on the pool
+    # of their device like scan jobs (one reader per rotational disk in inode order, 'jobs' per SSD)
+    todo = []
+    for tree in trees:
+      for path in tree.Files():
+        stat = self.snapshot.Stat(path)
+        if not stat: continue # vanished since listed, its node hashes it (or fails) as before
+        if digest := self.cache.Get(path, stat): self.leaves[path] = digest
+        else: todo.append(path)
+    if len(todo) < INLINE_JOBS or self.jobs == 1:
+      for path in todo: self.leaves[path] = self._Hash(path)
+      return
+    import devices
+    with devices.Scheduler(self.jobs, self.config.devices, self.snapshot.Stat) as scheduler:
+      places = [scheduler.Place([self.snapshot.Stat(path)]) for path in todo]
+      futures = {path: scheduler.Submit(dev, self._Hash, path) for path, (dev, _) in sorted(zip(todo, places), key=lambda item: item[1][1])}
+      for path, future in futures.items(): self.leaves[path] = future.result()
+
+  def _Subtree(self, name:str, trees:list, rel:str, full:bool):
+    # Jobs of the files under 'rel' in tree order, none when all copies have the same node.
+    # A file is skipped when its present copies share the digest ('full' lists every file).
+    if not full and len({tree.Node(rel) for tree in trees}) == 1:
+      metrics.Count("subtrees_pruned")
+      return
+    for entry, is_dir in sorted({entry for tree in trees for entry in tree.Entries(rel)}):
+      if is_dir:
+        yield from self._Subtree(name, trees, f"{rel}{entry}/", full)
+        continue
+      owners = [tree for tree in trees if (entry, False) in tree.Entries(rel)]
+      if not full and len({tree.Node(f"{rel}{entry}") for tree in owners}) == 1:
+        metrics.Count("files_pruned")
+        continue
+      yield self._FileJob(f"{name}/{rel}{entry}", [f"{tree.root}/{rel}{entry}" for tree in trees], False)
+
+  def _Digest(self, path:str) -> str:
+    # Merkle tree leaf: digest found by _Leaves, cached, or the file hashed now
+    if path in self.leaves: return self.leaves[path]
+    digest = self.cache.Get(path, self.snapshot.Stat(path)) or self._Hash(path)
+    self.leaves[path] = digest
+    return digest
+
+  def _Hash(self, path:str) -> str:
+    digest = utils.HashFile(path)
+    self.cache.Set(path, digest)
+    return digest
+
+  def _Jobs(self, entries:list[dict], full:bool):
+    # Scan phase input: every (library, name, paths) in config order
+    for sy in entries:
+      # Entry of a single file cut from a folder library by Select: copies may be missing as in the folder,
+      # with none left (a hook on a deleted file) there is nothing to sync
+      if sy.get("file", True):
+        name, paths = self._FileJob(sy["name"], sy["paths"], "library" not in sy)
+        if paths: yield sy.get("library", sy["name"]), name, paths
+      else:
+        for job in self._FolderJobs(sy["name"], sy["paths"], sy.get("whiteList", None), sy.get("blackList", []), full): yield sy["name"], *job
+
+  def _ScanFile(self, library:str, name:str, paths:list[str]) -> dict:
+    start = time.perf_counter()
+    stats = [self.snapshot.Stat(path) for path in paths]
+    if digest := self.db.Synced(paths, stats):
+      # Nothing changed since these copies were last synced together
+      groups, digests, states = [0] * len(paths), [digest] * len(paths), ["unchanged"] * len(paths)
+    else:
+      with metrics.Phase("compare"):
+        # Tree leaves were already looked up (and counted) by _Leaves, only the other paths ask the cache
+        known = [self.leaves.get(path) or self.cache.Get(path, stat) for path, stat in zip(paths, stats)]
+        groups, digests = utils.CompareFiles(paths, known, stats)
+      states = self.db.Classify(paths, stats, digests)
+    for path, digest in zip(paths, digests):
+      if digest: self.cache.Set(path, digest)
+    if xn.isUniform(groups): self._Synced(paths, digests[0])
+    metrics.Library(library, time.perf_counter() - start)
+    return {
+      "library": library,
+      "name": name,
+      "paths": paths,
+      "groups": groups,
+      "digests": digests,
+      "states": states,
+      "update_stamps": [stat.st_mtime for stat in stats],
+      "create_stamps": [stat.st_ctime for stat in stats]
+    }
+
+  def _Synced(self, paths:list[str], digest:str|None):
+    if digest:
+      for path in paths: self.db.Record(path, self.snapshot.Stat(path), digest)
+
+  def Scan(self, entries:list[dict]|None=None, full:bool=False) -> Iterator[dict]:
+    # Scan results in config order (so N.M tags stay stable), streamed while later libraries are scanned.
+    # Folder files equal in all copies are left out unless 'full'. Jobs run on the worker pool of their
+    # slowest device, only a bounded window of them is in flight, a few jobs are run inline.
+    if self.fresh: self.fresh = False # validation stats of this run, counted too
+    else:
+      if self.watcher: self._Refresh()
+      else: self.snapshot = utils.StatSnapshot()
+      self.snapshot.calls = self.snapshot.syscalls = 0
+      self.cache.hits = self.cache.misses = 0
+      self.db.skipped = self.db.listings = 0
+    self.libraries = index.PathIndex(self.config.sync, self.db.ListDir)
+    self.trees, self.scheduler, self.leaves = [], None, {}
+    queue = self._Jobs(self.config.sync if entries is None else entries, full)
+    head = list(itertools.islice(queue, INLINE_JOBS))
+    if self.jobs == 1 or len(head) < INLINE_JOBS:
+      for job in itertools.chain(head, queue): yield self._ScanFile(*job)
+      return
+    import devices
+    from collections import deque
+    pending = deque()
+    with devices.Scheduler(self.jobs, self.config.devices, self.snapshot.Stat) as self.scheduler:
+      for batch in itertools.batched(itertools.chain(head, queue), 8 * self.jobs):
+        # Within a window, jobs of a rotational disk are queued in inode order
+        places = [self.scheduler.Place([self.snapshot.Stat(path) for path in paths]) for _, _, paths in batch]
+        futures = {}
+        for i in sorted(range(len(batch)), key=lambda i: (places[i][1], i)):
+          futures[i] = self.scheduler.Submit(places[i][0], self._ScanFile, *batch[i])
+        while pending: yield pending.popleft().result()
+        pending.extend(futures[i] for i in range(len(batch)))
+      while pending: yield pending.popleft().result()
+
+  def Watch(self) -> bool:
+    # Long-lived engines (the daemon) keep the stat snapshot between scans, only the paths reported
+    # by inotify since the last scan are stated again. Paths inotify can't vouch for are stated every scan:
+    # copies on network mounts (edits from other machines raise no events) and, once a folder couldn't
+    # be watched, all of them. Without inotify every scan starts from scratch.
+    import watch, devices
+    roots = [path for sy in self.config.sync for path in sy["paths"]]
+    watcher = watch.Watcher(roots)
+    self.snapshot, self.fresh = utils.StatSnapshot(), False # stats taken before the watches could miss changes
+    if not watcher.inotify or watcher.inotify.failed:
+      if watcher.inotify: os.close(watcher.inotify.fd)
+      self.watcher = None
+      return False
+    self.watcher = watcher
+    kinds = devices.Scheduler(self.jobs, self.config.devices, self.snapshot.Stat) # device detection only, no pools
+    remote = [root for root in roots if (stat := self.snapshot.Stat(root)) and kinds.Device(stat.st_dev)[0] == "network"]
+    self.remote = tuple(f"{root}/" for root in remote)
+    return True
+
+  def _Refresh(self):
+    changed = set()
+    while events := self.watcher.inotify.Read(): changed |= events
+    if None in changed or self.watcher.inotify.failed: # overflow or a new folder left unwatched
+      self.snapshot = utils.StatSnapshot()
+      return
+    for path in changed:
+      self.snapshot.Invalidate(path)
+      self.snapshot.Invalidate(os.path.dirname(path))
+    if self.remote:
+      for path in [path for path in self.snapshot.stats if f"{path}/".startswith(self.remote)]: self.snapshot.Invalidate(path)
+
+  def Close(self):
+    # Stops watching and closes the state, a closed engine can't be used anymore
+    if self.watcher: os.close(self.watcher.inotify.fd)
+    self.watcher = None
+    self.db.db.close()
+
+  @staticmethod
+  def Latest(scan:dict) -> int:
+    return scan["update_stamps"].index(max(scan["update_stamps"]))
+
+  def Plan(self, scans:list[dict]) -> list[dict]:
+    # Update of every obsolete path, nothing is written yet. 'scan' and 'nbr' locate the path in 'scans',
+    # whose 'actions' are set to "planned" (None for the latest and up-to-date copies).
+    # The destination mtime is kept for a rollback, restored copies must not look like the latest ones.
+    # Digests lockstep compare didn't need are hashed here, Recover checks both ends against them.
+    actions = []
+    for nbr_scan, scan in enumerate(scans):
+      paths, groups, digests = scan["paths"], scan["groups"], scan["digests"]
+      id = self.Latest(scan)
+      scan["actions"] = [None] * len(paths)
+      for nbr, (file, group) in enumerate(zip(paths, groups)):
+        if group == groups[id]: continue
+        if digests[id] is None: digests[id] = self._Hash(paths[id])
+        digest = digests[nbr] = digests[nbr] or self._Hash(file)
+        scan["actions"][nbr] = "planned"
+        actions.append({"scan": nbr_scan, "nbr": nbr, "src": paths[id], "dst": file, "digest": digest, "src_digest": digests[id],
+          "mtime": self.snapshot.Stat(file).st_mtime_ns})
+    return actions
+
+  def _Backup(self, action:dict) -> str:
+    with metrics.Phase("backup"):
+      digest = self.store.Add(action["dst"], action["digest"], action["src"], action["src_digest"])
+    metrics.Count("bytes_backed_up", self.snapshot.Stat(action["dst"]).st_size)
+    return digest
+
+  def _Copy(self, action:dict) -> bool:
+    self.snapshot.Invalidate(action["dst"])
+    with metrics.Phase("copy"):
+      ok = utils.OverwriteFile(action["src"], action["dst"])
+    if ok: metrics.Count("bytes_copied", self.snapshot.Stat(action["src"]).st_size)
+    return ok
+
+  def Apply(self, actions:list[dict], scans:list[dict]|None=None) -> list[bool]:
+    # Runs the plan through the journal, 'actions' of the given 'scans' become "updated" or "failed"
+    # and fully updated libraries are recorded as synced
+    if not actions: return []
+    self.wal.Begin(actions)
+    with metrics.Phase("apply"):
+      results = self._Apply(actions)
+    for action, ok in zip(actions, results):
+      if scans: scans[action["scan"]]["actions"][action["nbr"]] = "updated" if ok else "failed"
+    for scan in scans or []:
+      if "failed" in scan["actions"] or "updated" not in scan["actions"]: continue
+      id = self.Latest(scan)
+      self._Synced(scan["paths"], scan["digests"][id] or utils.HashFile(scan["paths"][id]))
+    return results
+
+  def _Apply(self, actions:list[dict], backups:dict[int, str]|None=None, applied:set[int]|None=None) -> list[bool]:
+    # Journaled plan run batch by batch: backups are stored and synced, then destinations are replaced
+    # and their folders synced once per batch, each step is logged only when it's on disk.
+    # 'backups' and 'applied' are the steps an interrupted run already logged.
+    backups, applied = backups or {}, applied or set()
+    results = [i in applied for i in range(len(actions))]
+    todo = [i for i in range(len(actions)) if i not in applied]
+    import devices
+    with devices.Scheduler(self.jobs, self.config.devices, self.snapshot.Stat) as scheduler:
+      def Map(fn, indexes:list[int]) -> list:
+        if len(todo) < INLINE_JOBS or self.jobs == 1: return [fn(actions[i]) for i in indexes]
+        places = [scheduler.Place([self.snapshot.Stat(actions[i]["dst"]) or self.snapshot.Stat(actions[i]["src"])]) for i in indexes]
+        futures = [scheduler.Submit(dev, fn, actions[i]) for i, (dev, _) in zip(indexes, places)]
+        return [future.result() for future in futures]
+      for batch in itertools.batched(todo, APPLY_BATCH):
+        stored = [i for i in batch if i not in backups]
+        backups.update(zip(stored, Map(self._Backup, stored)))
+        self.store.Sync()
+        self.wal.Write({"backup": {i: backups[i] for i in stored}})
+        oks = Map(self._Copy, batch)
+        utils.SyncDirs(os.path.dirname(os.path.realpath(actions[i]["dst"])) for i in batch) # renamed at the link target
+        self.wal.Write({"done": [i for i, ok in zip(batch, oks) if ok]})
+        for i, ok in zip(batch, oks): results[i] = ok
+    self.wal.End()
+    return results
+
+  def Interrupted(self) -> bool:
+    return self.wal.Exists()
+
+  @staticmethod
+  def _Unchanged(path:str, digest:str|None) -> bool:
+    return os.path.isfile(path) and (digest is None or utils.HashFile(path) == digest)
+
+  def Recover(self, rollback:bool=False) -> dict:
+    # Interrupted update left in the journal: rolled back, otherwise finished. Updates whose source changed
+    # since are dropped, a copy they left half-written is restored first. Returns the counts.
+    actions, backups, applied = self.wal.Load()
+    restore = list(backups) if rollback else []
+    dropped = 0
+    if not rollback:
+      for i, action in enumerate(actions):
+        if i in applied or self._Unchanged(action["src"], action["src_digest"]) and (i in backups or self._Unchanged(action["dst"], action["digest"])): continue
+        if i in backups: restore.append(i)
+        applied.add(i)
+        dropped += 1
+    restored = 0
+    for i in restore:
+      if self._Unchanged(actions[i]["dst"], backups[i]): continue
+      if self.store.Restore({"path": actions[i]["dst"], "digest": backups[i]}):
+        os.utime(actions[i]["dst"], ns=(actions[i]["mtime"], actions[i]["mtime"]))
+        restored += 1
+    utils.SyncDirs(os.path.dirname(actions[i]["dst"]) for i in restore)
+    if rollback:
+      self.wal.End()
+      return {"rollback": True, "restored": restored, "backed_up": len(backups)}
+    pending = [i for i in range(len(actions)) if i not in applied]
+    self.wal.Resume()
+    results = self._Apply(actions, backups, applied)
+    failed = sum(not results[i] for i in pending)
+    return {"rollback": False, "updated": len(pending) - failed, "failed": failed, "dropped": dropped}
+
+  def Diff(self, pairs:list[tuple[str, str, str, str]], max_lines:int|None=None) -> list[tuple[bool, list[str]]]:
+    # (binary, diff lines) of (tag, name, obsolete, latest) pairs, rendered in parallel
+    import patch
+    return list(patch.Pairs(pairs, max_lines or patch.MAX_LINES, self.jobs))
+
+  def Expire(self):
+    # Drops cache and state entries outside the config, the next Save writes that
+    roots = [path for sy in self.config.sync for path in sy["paths"]]
+    self.cache.Expire(roots)
+    self.db.Expire(roots)
+
+  def Save(self, expire:bool=True):
+    # Writes the state rows changed since the last save and the cache when an entry changed.
+    # Runs narrowed by Select pass 'expire=False', they shouldn't pay for the whole config.
+    if expire: self.Expire()
+    self.cache.Save()
+    self.db.Save()
@@ -0,0 +1,77 @@
+import utils, canon
+import os, threading
+
+class PathIndex():
+  # Library paths of the whole config by canonical path, built once per run. It finds the physical paths
+  # claimed by several libraries and the paths lying in a folder of another library, and serves the folder
+  # listings of all libraries from one shared cache (each folder is listed once per run).
+  def __init__(self, sync:list[dict], listdir):
+    self.sync = sync
+    self.listdir = listdir
+    self.listings:dict[str, list[tuple[str, bool]]] = {}
+    self.lock = threading.Lock()
+    self.hits = 0
+    self.roots:dict[str, dict]|None = None
+
+  def Owners(self) -> dict[str, list[tuple[str, str]]]:
+    # Canonical path (symlinks resolved, case folded where ignored) -> (library, path as configured)
+    owners = {}
+    for sy in self.sync:
+      for path in sy["paths"]:
+        owners.setdefault(canon.Key(path), []).append((sy["name"], path))
+    return owners
+
+  def Overlaps(self, isdir=os.path.isdir) -> list[tuple[str, str, str, str, str]]:
+    # (kind, path, library, other path, other library): 'same' physical path in two libraries, or a path
+    # 'nested' in the folder of another library. Each path looks up its own ancestors only, so the cost
+    # is linear in the number of paths (times their depth). 'isdir' gets the path as configured,
+    # so the validation snapshot answers it.
+    owners = self.Owners()
+    folders = {path: claims[0] for path, claims in owners.items() if isdir(claims[0][1])}
+    overlaps = []
+    for path, claims in owners.items():
+      first_name, first_path = claims[0]
+      for name, other in claims[1:]:
+        overlaps.append(("same", other, name, first_path, first_name))
+      parent = os.path.dirname(path)
+      while parent and parent != path:
+        if parent in folders:
+          for name, other in claims:
+            if name != folders[parent][0]: overlaps.append(("nested", other, name, folders[parent][1], folders[parent][0]))
+          break
+        path, parent = parent, os.path.dirname(parent)
+    return overlaps
+
+  def ListDir(self, path:str) -> list[tuple[str, bool]]:
+    # Every library walking the folder shares the listing, a folder is listed (or stated) once per run
+    with self.lock:
+      if path in self.listings:
+        self.hits += 1
+        return self.listings[path]
+    listing = self.listdir(path)
+    with self.lock: self.listings[path] = listing
+    return listing
+
+  def Lookup(self, path:str) -> dict|None:
+    # Entry syncing the path: its library, or for a file in a folder library an entry of that file alone
+    # ('library' names the folder library). Ancestors of the path are looked up in a prefix index
+    # of all library paths, so the cost depends on the path depth, not on the config size.
+    if self.roots is None:
+      self.roots = {}
+      for sy in self.sync:
+        for root in sy["paths"]: self.roots.setdefault(root, sy)
+    rel = ""
+    while path not in self.roots:
+      parent = os.path.dirname(path)
+      if parent == path: return None
+      rel = f"{os.path.basename(path)}/{rel}" if rel else os.path.basename(path)
+      path = parent
+    sy = self.roots[path]
+    if not rel: return sy
+    if sy.get("file", True): return None
+    if os.path.isdir(f"{path}/{rel}"): return sy
+    whitelist, blacklist = utils.CompileGlobs(sy.get("whiteList")), utils.CompileGlobs(sy.get("blackList"))
+    parts = rel.split("/")
+    if blacklist and any(blacklist.match("/".join(parts[:i])) for i in range(1, len(parts) + 1)): return None
+    if whitelist and not whitelist.match(rel): return None
+    return {"name": f"{sy["name"]}/{rel}", "library": sy["name"], "paths": [f"{root}/{rel}" for root in sy["paths"]], "file": True}
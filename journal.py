@@ -0,0 +1,46 @@
+import xaeian as xn, utils
+import os, json
+
+class Journal():
+  # Write-ahead log of an update: the planned actions, then the indexes backed up (with their backup digest)
+  # and the indexes applied, one JSON line each, every line fsynced before the step it records goes on.
+  # The file exists only while an update runs, a leftover one is an interrupted update.
+  def __init__(self, path:str="journal.ndjson"):
+    self.path = xn.FixPath(path) # next to the state files, not in the working folder
+    self.file = None
+
+  def Exists(self) -> bool:
+    return os.path.isfile(self.path)
+
+  def Load(self) -> tuple[list[dict], dict[int, str], set[int]]|None:
+    # (actions, backup digests, applied) of the interrupted update, a line torn by the crash ends it
+    try: file = open(self.path, "r", encoding="utf-8")
+    except FileNotFoundError: return None
+    actions, backups, applied = [], {}, set()
+    with file:
+      for line in file:
+        try: entry = json.loads(line)
+        except ValueError: break
+        actions = entry.get("plan", actions)
+        backups.update((int(i), digest) for i, digest in entry.get("backup", {}).items())
+        applied.update(entry.get("done", []))
+    return actions, backups, applied
+
+  def Begin(self, actions:list[dict]):
+    self.file = open(self.path, "w", encoding="utf-8")
+    self.Write({"plan": actions})
+    utils.SyncDirs([os.path.dirname(self.path)])
+
+  def Resume(self):
+    self.file = open(self.path, "a", encoding="utf-8")
+
+  def Write(self, entry:dict):
+    self.file.write(json.dumps(entry, separators=(",", ":")) + "\n")
+    self.file.flush()
+    os.fsync(self.file.fileno())
+
+  def End(self):
+    if self.file: self.file.close()
+    self.file = None
+    os.remove(self.path)
+    utils.SyncDirs([os.path.dirname(self.path)])
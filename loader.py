@@ -0,0 +1,63 @@
+import xaeian as xn, canon
+import os, re, hashlib
+from collections import ChainMap
+
+PLACEHOLDER = re.compile(r"\{([^{}]+)\}") # any key dict.ini accepts, e.g. {my-root} or {lib.v2}
+PLAN_VERSION = 4
+
+def Expand(subject:str|list|dict, mapping, unknown:set|None=None):
+  # Single regex pass replacing '{key}', keys missing in the mapping are kept and collected in 'unknown'
+  if isinstance(subject, str):
+    def Replace(match:re.Match) -> str:
+      key = match.group(1)
+      if key in mapping: return str(mapping[key])
+      if unknown is not None: unknown.add(key)
+      return match.group(0)
+    return PLACEHOLDER.sub(Replace, subject)
+  elif isinstance(subject, list):
+    return [Expand(item, mapping, unknown) for item in subject]
+  elif isinstance(subject, dict):
+    return {key: Expand(value, mapping, unknown) for key, value in subject.items()}
+  return subject
+
+def ResolveDict(mydict:dict) -> dict:
+  # 'dict.ini' values may refer to other keys, e.g. 'lib = {web}/lib'
+  resolved = {key: value for key, value in mydict.items() if not isinstance(value, dict)}
+  for _ in range(len(resolved)):
+    expanded = Expand(resolved, resolved)
+    if expanded == resolved: break
+    resolved = expanded
+  return resolved
+
+def ExpandSync(sync:list[dict], mydict:dict) -> dict[str, set]:
+  # Expands names, paths and white/black lists in place, returns unknown placeholders per library
+  unknowns = {}
+  for sy in sync:
+    unknown = set()
+    sy["name"] = Expand(sy["name"], mydict, unknown)
+    mapping = ChainMap({"name": sy["name"]}, mydict)
+    for key in ("paths", "whiteList", "blackList"):
+      if key in sy: sy[key] = Expand(sy[key], mapping, unknown)
+    if unknown: unknowns[sy["name"]] = unknown
+  return unknowns
+
+def Devices(section:dict, mydict:dict) -> dict[str, str|int]:
+  # '[devices]' of 'dict.ini': a path on the device, then its kind or worker count, e.g. '{archive} = rotational'
+  return {canon.Normal(xn.FixPath(Expand(path, mydict))): value.lower() if isinstance(value, str) else value for path, value in section.items()}
+
+def Fingerprint(paths:list[str]) -> str:
+  # Content hash of the config files, together with their locations and the plan format
+  hasher = hashlib.sha1(f"{PLAN_VERSION}".encode())
+  for path in paths:
+    path = xn.FixPath(path)
+    hasher.update(path.encode())
+    if os.path.isfile(path):
+      with open(path, "rb") as file: hasher.update(file.read())
+  return hasher.hexdigest()
+
+def LoadPlan(path:str, fingerprint:str) -> dict|None:
+  plan = xn.JSON.Load(path, {})
+  return plan if plan.get("fingerprint") == fingerprint else None
+
+def SavePlan(path:str, fingerprint:str, sync:list[dict], devices:dict[str, str|int]):
+  xn.JSON.Save(path, {"fingerprint": fingerprint, "sync": sync, "devices": devices})
@@ -1,6 +1,6 @@
-import xaeian as xn, utils
-import os, sys, argparse
-from datetime import datetime
+# Only modules every mode needs are imported here, the rest is imported where its mode starts
+import xaeian as xn, utils, backup, metrics, canon
+import os, sys, time, argparse
 
 class Ico(xn.IcoText): pass
 class Color(xn.Color): pass
@@ -9,19 +9,72 @@ xn.FIX_PATH = True
 
 parser = argparse.ArgumentParser(description="PySync")
 parser.add_argument("-u", "--update", action="store_true", help="Update libraries to latest version (most recently modified)")
+parser.add_argument("-n", "--dry-run", action="store_true", help="With -u, list the planned updates (source, destination, backup) without applying them")
+parser.add_argument("--rollback", action="store_true", help="Roll back an interrupted update recorded in 'journal.ndjson' instead of resuming it")
+parser.add_argument("-o", "--only", type=str, action="append", help="Synchronize only the libraries with this name or glob, may be repeated", default=None)
+parser.add_argument("-p", "--path", type=str, help="Synchronize only the library (or the single file of a folder library) owning this path, for editor save hooks", default=None)
 parser.add_argument("-i", "--info", action="store_true", help="Displays a list of all synchronized files (not quiet)")
 parser.add_argument("-e", "--example", action="store_true", help="Create example configuration files 'dict.ini' and 'sync.ini'")
-parser.add_argument("-d", "--diff", type=str, nargs="?", help="Compare the selected files based on the provided tag: <lasted>.<obsolete>", default="")
+parser.add_argument("-d", "--diff", type=str, nargs="?", help="Compare the selected files based on the provided tag: <lasted>.<obsolete>, or 'all' divergent pairs", default="")
+parser.add_argument("--diff-lines", type=int, help="Diff lines shown per pair, longer diffs are cut (default: 2000)", default=2000)
+parser.add_argument("--patch", type=str, help="Save the diffs selected by -d --diff as a patch bundle file instead of showing them", default=None)
+parser.add_argument("-a", "--hash", type=str, choices=utils.HASH_ALGORITHMS, help=f"Hash algorithm used to compare files (default: {utils.HASH_ALGORITHM})", default=utils.HASH_ALGORITHM)
+parser.add_argument("-j", "--jobs", type=int, help="Number of libraries scanned in parallel (default: auto)", default=None)
+parser.add_argument("--serve", action="store_true", help="Run as a daemon keeping config and caches warm, later runs in the same config folder are forwarded to it")
+parser.add_argument("-w", "--watch", action="store_true", help="Keep running and synchronize libraries when their files change")
+parser.add_argument("-c", "--compress", type=str, choices=backup.COMPRESSIONS, help=f"Compression of new backup objects (default: {backup.COMPRESSION})", default=backup.COMPRESSION)
+parser.add_argument("-r", "--restore", type=str, help="Restore file from the latest backup of its path (or the one selected by --at)")
+parser.add_argument("--at", type=str, help="Restore the latest backup taken at or before the time: 'YYYY-MM-DD HH:MM:SS'")
+parser.add_argument("--gc", action="store_true", help="Prune backups by --keep-days and --keep, then remove unreferenced objects")
+parser.add_argument("--keep-days", type=int, help="Backups older than this number of days are pruned by --gc")
+parser.add_argument("--keep", type=int, help="Only this number of newest backups per path are kept by --gc")
+parser.add_argument("-C", "--config", type=str, help="Folder with 'sync.json' and 'dict.ini', cache, state and backups are kept there too (default: program folder)", default=None)
+parser.add_argument("-s", "--stats", type=str, nargs="?", const="-", help="Per-phase timing and I/O counters, printed or saved as JSON to the given file", default=None)
+parser.add_argument("--profile", type=str, help="Run under cProfile and dump pstats to the given file (main thread only, use -j 1 for the full picture)", default=None)
+parser.add_argument("-f", "--format", type=str, choices=["human", "ndjson"], help="Report format, 'ndjson' writes one JSON record per library and copy (default: human)", default="human")
 parser.add_argument("-v", "--version", action="store_true", help="Program version and repository location")
 args = parser.parse_args()
+utils.HASH_ALGORITHM = args.hash
+config = canon.Normal(args.config).rstrip("/") + "/" if args.config else ""
+metrics.ENABLED = args.stats is not None
+
+if args.profile:
+  import cProfile, atexit
+  profiler = cProfile.Profile()
+  atexit.register(lambda: (profiler.disable(), profiler.dump_stats(args.profile)))
+  profiler.enable()
 
 if args.version:
+  # 1.18.0: Resident daemon --serve, runs forwarded through its socket
+  # 1.17.0: Embeddable SyncEngine (engine.py), the CLI only reports
+  # 1.16.0: Canonical paths ('..', symlinks, letter case) memoized in one place
+  # 1.15.0: Merkle trees of folder libraries, equal subtrees are skipped
+  # 1.14.0: Targeted runs -o --only & -p --path
+  # 1.13.0: Shared folder listings & overlapping libraries check
+  # 1.12.0: Plan & apply updates through a crash-safe journal, -n --dry-run, --rollback
+  # 1.11.0: Per-device worker pools (rotational, SSD, network) with [devices] overrides
+  # 1.10.0: In-place block updates & reverse delta backups of large files
+  # 1.9.0: Diff engine: -d all, --patch bundle, binary files, --diff-lines cap & pager
+  # 1.8.3: Lazy imports per mode, inline scan of small configs
+  # 1.8.2: Single pass placeholders, cached 'plan.json'
+  # 1.8.1: NDJSON report -f --format
+  # 1.8.0: Instrumentation -s --stats, --profile
+  # 1.7.1: Config folder -C --config
+  # 1.7.0: SQLite 'state.db' of last synced versions, conflict warning
+  # 1.6.0: Content-addressed backup store + --restore, --gc
+  # 1.5.0: Watch mode -w --watch
+  # 1.4.1: Single stat per path snapshot
+  # 1.4.0: Recursive SyncFolder with glob whiteList & blackList
+  # 1.3.3: Parallel scan -j --jobs
+  # 1.3.2: Tiered file comparison (size, samples, lockstep)
+  # 1.3.1: Streaming hash with -a --hash algorithm
+  # 1.3.0: Persistent hash cache 'cache.json'
   # 1.2.2: FIX load file
   # 1.2.1: Compare files -d --diff
   # 1.2.0: Auto-detect file/folder + info + paths unique lib only
   # 1.1.0: Union files for SyncFolder
   # 1.0.0: Init + (whiteList & blackList)
-  print(f"LipySync {Color.BLUE}1.2.1{Color.END}")
+  print(f"LipySync {Color.BLUE}1.18.0{Color.END}")
   print(f"Repo: {Color.GREY}https://{Color.END}github.com/{Color.TEAL}Xaeian{Color.END}/LipySync")
   sys.exit(0)
 
@@ -30,145 +83,250 @@ if args.example:
   example.Create()
   sys.exit(0)
 
-sync = xn.JSON.Load("sync.json")
-if not sync:
-  print(f"{Ico.ERR} Missing file or invalid config file {Color.RED}sync.json{Color.END}")
-  sys.exit(1)
-mydict = xn.INI.Load("dict.ini")
-if not sync:
-  print(f"{Ico.ERR} Missing file or invalid config file {Color.RED}dict.json{Color.END}")
-  sys.exit(1)
-
-reversed_mydict = {value: key for key, value in mydict.items()}
-sync = xn.ReplaceMap(sync, mydict, "{", "}")
-for sy in sync:
-  sy["paths"] = xn.ReplaceMap(sy["paths"], { "name": sy["name"] }, "{", "}")
-
-# Validation to ensure names & paths are unique
-name_set = set()
-for sy in sync:
-  if sy["name"] in name_set:
-    print(f"{Ico.ERR} Synchronized library name {Color.RED}{sy["name"]}{Color.END} is duplicated")
+sock = xn.FixPath(f"{config}lipysync.sock") # daemon socket, next to the state files
+if not (args.serve or args.watch or args.gc or args.restore or args.profile) and os.path.exists(sock):
+  # Report, update & diff runs are forwarded to the daemon, a stale socket falls back to a standalone run
+  import serve
+  request = vars(args) | {key: os.path.abspath(vars(args)[key]) for key in ("path", "patch", "stats") if vars(args)[key] not in (None, "-")}
+  code = serve.Forward(sock, {"args": request, "argv": sys.argv[1:]})
+  if code is not None: sys.exit(code)
+
+store = backup.Store(f"{config}backups", args.compress)
+
+if args.gc:
+  if args.keep_days is None and args.keep is None:
+    print(f"{Ico.ERR} Select backups to prune with {Color.YELLOW}--keep-days{Color.END} or {Color.YELLOW}--keep{Color.END}")
     sys.exit(1)
-  name_set.add(sy["name"])
-  path_set = set()
-  cnt_file = 0
-  cnt_dir = 0
-  for path in sy["paths"]:
-    if path.startswith("#"):
-      sy["paths"].remove(path)
-      continue
-    if os.path.isfile(path): cnt_file += 1
-    elif os.path.isdir(path): cnt_dir += 1
-    else:
-      print(f"{Ico.ERR} Path {Color.ORANGE}{path}{Color.END} in library {Color.RED}{sy["name"]}{Color.END} doesn't exist")
-    if path in path_set:
-      print(f"{Ico.ERR} Path {Color.ORANGE}{path}{Color.END} in library {Color.RED}{sy["name"]}{Color.END} appears multiple times")
-      sys.exit(1)
-    path_set.add(path)
-  if cnt_file and cnt_dir:
-    print(f"{Ico.ERR} Library {Color.RED}{sy["name"]}{Color.END} contains files and folders paths")
-  sy["file"] = True if cnt_file else False 
-
-diff = {}
-if args.diff:
-  diff["lasted_nbr"], diff["obsolete_nbr"] = map(int, args.diff.split('.'))
-
-class Update():
-  flag = False
-  nbr_last = 0
-
-def SyncFile(name:str, paths:list[str], must_exist:bool=True):
-  paths = [xn.FixPath(path) for path in paths]
-  if must_exist:
-    missing = [file for file in paths if not os.path.isfile(file)]
-    if missing:
-      print(f"{Ico.ERR} Missing {Color.RED}{name}{Color.END} file: {Color.ORANGE}{missing[0]}{Color.END}")
+  rows, objects = store.Prune(args.keep_days, args.keep)
+  print(f"{Ico.OK} Pruned {Color.YELLOW}{rows}{Color.END} backups and {Color.YELLOW}{objects}{Color.END} objects")
+  sys.exit(0)
+
+if args.restore:
+  path = canon.Normal(args.restore)
+  row = store.Find(path, args.at)
+  if not row:
+    print(f"{Ico.ERR} No backup of {Color.ORANGE}{path}{Color.END} {f"at {args.at}" if args.at else ""}")
+    sys.exit(1)
+  if os.path.isfile(path): store.Add(path)
+  if not store.Restore(row):
+    print(f"{Ico.ERR} Missing backup object {Color.RED}{row["digest"]}{Color.END}")
+    sys.exit(1)
+  print(f"{Ico.OK} File {Color.GREY}{path}{Color.END} restored from {Color.TEAL}{row["time"]}{Color.END}")
+  sys.exit(0)
+
+import engine
+
+def Notice(run:argparse.Namespace, level:str, message:str):
+  # Error or warning line, in '-f ndjson' a record of that type without colors (the stream stays parseable)
+  if run.format == "ndjson":
+    import report
+    report.Ndjson().Write(level, message=report.Plain(message))
+  else: print(f"{Ico.ERR if level == "error" else Ico.WRN} {message}")
+
+def Load(run:argparse.Namespace) -> engine.SyncEngine:
+  # Engine of the config folder, a config error ends the run
+  try: return engine.SyncEngine(engine.Config(config), args.jobs, store)
+  except engine.SyncError as e:
+    Notice(run, "error", str(e))
+    sys.exit(1)
+
+def Sync(args:argparse.Namespace, sync_engine:engine.SyncEngine, expire:bool=True):
+  # Report, update and diff run of the CLI, also run by the daemon for every forwarded request
+  # (it expires the cache and state once per config load, not per run)
+  ndjson = None
+  if args.format == "ndjson":
+    import report
+    ndjson = report.Ndjson()
+  for level, message in sync_engine.config.issues: Notice(args, level, message)
+  try: entries = sync_engine.Select(args.only, args.path) # libraries of this run
+  except engine.SyncError as e:
+    Notice(args, "error", str(e))
+    sys.exit(1)
+  expire = expire and not (args.only or args.path) # a targeted run (editor or git hook) leaves the rest of the config alone
+
+  pairs = [] # (tag, name, obsolete, latest) selected by -d --diff
+  diff_tag = None
+  if args.diff and args.diff != "all":
+    try: diff_tag = tuple(map(int, args.diff.split(".")))
+    except ValueError:
+      Notice(args, "error", f"Invalid {Color.GREEN}{args.diff}{Color.END} tag selected for comparing files")
       sys.exit(1)
-  else:
-    paths = [file for file in paths if os.path.isfile(file)]
-  hashs = [utils.HashFile(path) for path in paths]
-  update_stamps = [os.path.getmtime(path) for path in paths]
-  create_stamps = [os.path.getctime(path) for path in paths]
-  dts = [datetime.fromtimestamp(stamp).strftime('%Y-%m-%d %H:%M:%S') for stamp in update_stamps]
-  if xn.isUniform(hashs) and not args.info: return
-  stamp_max = max(update_stamps)
-  id = update_stamps.index(stamp_max)
-  lats_hash = hashs[id]
-  lats_file = paths[id]
-  lats_dt = dts[id]
-  Update.nbr_last += 1
-  nbr_obsolete = 0
-  if diff and diff["lasted_nbr"] == Update.nbr_last:
-    diff["lasted_file"] = lats_file
-    diff["name"] = name
-  ico = Ico.OK if args.update else Ico.INF
-  print(f"{ico} {Color.YELLOW}{Update.nbr_last}{Color.GREY}.x{Color.END} Latest file {Color.BLUE}{name}{Color.END}: {Color.GREY}{lats_file}{Color.END} {Color.TEAL}{lats_dt}{Color.END}")
-  for file, hash, dt, ustamp, cstamp in zip(paths, hashs, dts, update_stamps, create_stamps):
-    if hash != lats_hash:
-      color = Color.YELLOW
-      if diff and diff["lasted_nbr"] == Update.nbr_last and diff["obsolete_nbr"] == nbr_obsolete:
-        diff["obsolete_file"] = file
-        color = Color.GREEN
-      Update.flag = True
-      nbr_obsolete += 1
-      if args.update:
-        backup_name = xn.ReplaceMap(file, reversed_mydict).replace("/", utils.SEP).replace("\\", utils.SEP)
-        utils.BackupFile(file, backup_name)
-        if utils.OverwriteFile(lats_file, file):
+
+  class Update():
+    flag = False
+    nbr_last = 0
+
+  def Report(scan:dict):
+    name, paths, groups = scan["name"], scan["paths"], scan["groups"]
+    update_stamps, create_stamps = scan["update_stamps"], scan["create_stamps"]
+    dts = [time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(stamp)) for stamp in update_stamps]
+    if xn.isUniform(groups) and not args.info: return
+    id = sync_engine.Latest(scan)
+    lats_group = groups[id]
+    lats_file = paths[id]
+    lats_dt = dts[id]
+    Update.nbr_last += 1
+    nbr_obsolete = 0
+    modified = {group for group, mode in zip(groups, scan["states"]) if mode == "modified"}
+    if ndjson:
+      ndjson.Write("library", tag=Update.nbr_last, name=name, library=scan["library"], latest=lats_file, uniform=xn.isUniform(groups), conflict=len(modified) > 1,
+        paths=paths, digests=scan["digests"], mtimes=update_stamps, states=scan["states"])
+    else:
+      ico = Ico.OK if args.update else Ico.INF
+      print(f"{ico} {Color.YELLOW}{Update.nbr_last}{Color.GREY}.x{Color.END} Latest file {Color.BLUE}{name}{Color.END}: {Color.GREY}{lats_file}{Color.END} {Color.TEAL}{lats_dt}{Color.END}")
+      if len(modified) > 1:
+        print(f"{Ico.WRN} Conflict: {Color.YELLOW}{len(modified)}{Color.END} different versions were modified since the last sync")
+    for nbr, (file, group, digest, dt, ustamp, cstamp) in enumerate(zip(paths, groups, scan["digests"], dts, update_stamps, create_stamps)):
+      if group != lats_group:
+        Update.flag = True
+        nbr_obsolete += 1
+        color = Color.YELLOW
+        if args.diff == "all" or diff_tag == (Update.nbr_last, nbr_obsolete):
+          pairs.append((f"{Update.nbr_last}.{nbr_obsolete}", name, file, lats_file))
+          if diff_tag: color = Color.GREEN
+        action = scan["actions"][nbr] if args.update else "obsolete"
+        if ndjson:
+          ndjson.Write("copy", tag=f"{Update.nbr_last}.{nbr_obsolete}", name=name, path=file, digest=digest, mtime=ustamp,
+            latest=lats_file, latest_digest=scan["digests"][id], action=action, recent=ustamp == cstamp)
+        elif action == "updated":
           print(f"{Ico.GAP} {color}{Update.nbr_last}.{nbr_obsolete}{Color.END} File {Color.GREY}{file}{Color.END} update {Color.GREEN}OK{Color.END}")
-        else:
+        elif action == "failed":
           print(f"{Ico.GAP} {color}{Update.nbr_last}.{nbr_obsolete}{Color.END} File {Color.GREY}{file}{Color.END} update {Color.RED}failed{Color.END}")
+        elif action == "planned":
+          print(f"{Ico.GAP} {color}{Update.nbr_last}.{nbr_obsolete}{Color.END} File {Color.GREY}{file}{Color.END} would be backed up and replaced {Color.GREY}(dry run){Color.END}")
+        else:
+          print(f"{Ico.GAP} {color}{Update.nbr_last}.{nbr_obsolete}{Color.END} Obsolete file: {Color.GREY}{file}{Color.END} needs update {Color.ORANGE}{dt}{Color.END}")
+          if ustamp == cstamp:
+            print(f"{Ico.ERR} But it was created recently, make sure it's not actually newer!")
+      elif (args.update or args.info) and file != lats_file and not ndjson:
+        print(f"{Ico.OK} File {Color.GREY}{file}{Color.END} is up-to-date")
+
+  def Synchronize(entries:list[dict], watching:bool=False):
+    # Scan, then in update mode plan every update, apply the plan through the journal (unless --dry-run)
+    # and report the libraries with obsolete copies once it's done. An error ends the run, in watch
+    # rounds it's reported and the next change is awaited (e.g. a copy deleted in the meantime).
+    staged = []
+    try:
+      for scan in sync_engine.Scan(entries, args.info):
+        if args.update and (not xn.isUniform(scan["groups"]) or args.info): staged.append(scan)
+        else: Report(scan)
+      actions = sync_engine.Plan(staged)
+      if not args.dry_run: sync_engine.Apply(actions, staged)
+    except engine.SyncError as e:
+      Notice(args, "error", str(e))
+      if watching: return
+      sys.exit(1)
+    for scan in staged: Report(scan)
+
+  if sync_engine.Interrupted():
+    if args.update or args.rollback:
+      result = sync_engine.Recover(args.rollback)
+      if ndjson: ndjson.Write("recovery", **result)
+      elif result["rollback"]:
+        print(f"{Ico.OK} Interrupted update rolled back, {Color.YELLOW}{result["restored"]}{Color.END} of {Color.YELLOW}{result["backed_up"]}{Color.END} files restored")
       else:
-        print(f"{Ico.GAP} {color}{Update.nbr_last}.{nbr_obsolete}{Color.END} Obsolete file: {Color.GREY}{file}{Color.END} needs update {Color.ORANGE}{dt}{Color.END}")
-        if ustamp == cstamp:
-          print(f"{Ico.ERR} But it was created recently, make sure it's not actually newer!")
-    elif (args.update or args.info) and file != lats_file:
-      print(f"{Ico.OK} File {Color.GREY}{file}{Color.END} is up-to-date")
-
-def SyncFolder(name:str, paths:list[str], whitelist:list[str]|None=None, blacklist:list[str]=[]):
-  try:
-    files = [utils.FileList(path) for path in paths]
-  except Exception as e:
-    print(f"{Ico.ERR} {e}")
-    sys.exit(1)
-  files = utils.UnionList(files)
-  if whitelist: files = utils.IntersectionList([files] + [whitelist])
-  files = [file for file in files if file not in blacklist]
-  for file in files:
-    files_path = [f"{path}/{file}" for path in paths]
-    SyncFile(f"{name}/{file}", files_path, False)
-
-for sy in sync:
-  whitelist = sy.get("whiteList", None)
-  blacklist = sy.get("blackList", [])
-  if sy.get("file", True): SyncFile(sy["name"], sy["paths"])
-  else: SyncFolder(sy["name"], sy["paths"], whitelist, blacklist)
-
-if not Update.flag:
-  print(f"{Ico.INF} All files are in the same version {Color.GREY}(no update is needed){Color.END}")
-elif not args.update:
-  print(f"{Ico.RUN} Update older files using {Color.YELLOW}-u{Color.END} {Color.GREY}--update{Color.END} flag")
-  print(f"{Ico.RUN} Display files changes using {Color.YELLOW}-d{Color.END} {Color.GREY}--diff{Color.END} flag")
-  if args.diff:
-    if not diff or "obsolete_file" not in diff:
-      print(f"{Ico.ERR} Invalid {Color.GREEN}{args.diff}{Color.END} tag selected for comparing files")
+        print(f"{Ico.OK} Interrupted update resumed, {Color.GREEN}{result["updated"]}{Color.END} files updated" +
+          (f", {Color.RED}{result["failed"]}{Color.END} failed" if result["failed"] else "") +
+          (f", {Color.ORANGE}{result["dropped"]}{Color.END} dropped (source changed since)" if result["dropped"] else ""))
+    else: Notice(args, "warning", f"Interrupted update found, finish it with {Color.YELLOW}-u{Color.END} or undo it with {Color.YELLOW}--rollback{Color.END}")
+
+  with metrics.Phase("run"):
+    Synchronize(entries)
+
+  sync_engine.Save(expire)
+  cache, snapshot, scheduler = sync_engine.cache, sync_engine.snapshot, sync_engine.scheduler
+  if ndjson:
+    ndjson.Write("summary", update_needed=Update.flag and not args.update, updated=Update.flag and args.update, libraries=Update.nbr_last,
+      cache_hits=cache.hits, cache_misses=cache.misses)
+    ndjson.Flush()
+  elif args.info:
+    print(f"{Ico.INF} Hash cache {Color.GREEN}{cache.hits}{Color.END} hits, {Color.YELLOW}{cache.misses}{Color.END} misses")
+    print(f"{Ico.INF} Stat snapshot {Color.GREEN}{snapshot.saved}{Color.END} syscalls saved, {Color.YELLOW}{snapshot.syscalls}{Color.END} made")
+    print(f"{Ico.INF} State {Color.GREEN}{sync_engine.db.skipped}{Color.END} libraries unchanged since last sync, {Color.YELLOW}{sync_engine.db.listings}{Color.END} folders listed, {Color.GREEN}{sync_engine.libraries.hits}{Color.END} listings shared")
+    for name, roots in sync_engine.trees:
+      if len({root for _, root in roots}) == 1:
+        print(f"{Ico.INF} Library {Color.BLUE}{name}{Color.END} tree {Color.GREEN}{roots[0][1][:12]}{Color.END} in all {len(roots)} copies")
+      else:
+        for path, root in roots: print(f"{Ico.INF} Library {Color.BLUE}{name}{Color.END} tree {Color.YELLOW}{root[:12]}{Color.END} {Color.GREY}{path}{Color.END}")
+    for dev, count in scheduler.counts.items() if scheduler else []:
+      kind, limit = scheduler.devices[dev]
+      print(f"{Ico.INF} Device {Color.BLUE}{os.major(dev)}:{os.minor(dev)}{Color.END} {kind}, {Color.YELLOW}{limit}{Color.END} workers, {Color.GREEN}{count}{Color.END} jobs")
+
+  if metrics.ENABLED:
+    metrics.Count("files_stated", snapshot.syscalls)
+    metrics.Count("cache_hits", cache.hits)
+    metrics.Count("cache_misses", cache.misses)
+    summary = metrics.Summary()
+    if args.stats != "-":
+      xn.JSON.SavePretty(os.path.abspath(args.stats), summary)
+    elif ndjson:
+      ndjson.Write("stats", **summary)
+    else:
+      for phase, value in summary["phases"].items():
+        print(f"{Ico.INF} Phase {Color.BLUE}{phase:<9}{Color.END} {value["wall"] * 1000:9.1f} ms wall {Color.GREY}{value["cpu"] * 1000:9.1f} ms cpu {value["calls"]:>6}x{Color.END}")
+      for counter, value in summary["counters"].items():
+        print(f"{Ico.INF} Counter {Color.BLUE}{counter:<16}{Color.END} {value}")
+      for library in summary["slowest"]:
+        print(f"{Ico.INF} Slow library {Color.YELLOW}{library["name"]}{Color.END} {library["wall"] * 1000:.1f} ms")
+
+  if ndjson:
+    pass
+  elif not Update.flag:
+    print(f"{Ico.INF} All files are in the same version {Color.GREY}(no update is needed){Color.END}")
+  elif not args.update:
+    print(f"{Ico.RUN} Update older files using {Color.YELLOW}-u{Color.END} {Color.GREY}--update{Color.END} flag")
+    print(f"{Ico.RUN} Display files changes using {Color.YELLOW}-d{Color.END} {Color.GREY}--diff{Color.END} flag")
+
+  if args.diff and Update.flag and not args.update and (args.patch or not ndjson):
+    if not pairs:
+      Notice(args, "error", f"Invalid {Color.GREEN}{args.diff}{Color.END} tag selected for comparing files")
       sys.exit(1)
-    print(f"{Ico.DOC} Difference file {Color.BLUE}{diff["name"]}{Color.END}, tag {Color.GREEN}{diff["lasted_nbr"]}.{diff["obsolete_nbr"]}{Color.END}:")
-    import difflib
-    from rich.console import Console
-    from rich.syntax import Syntax
-    diff_print = ""
-    obsolete_file = xn.FILE.LoadLines(diff["obsolete_file"])
-    lasted_file = xn.FILE.LoadLines(diff["lasted_file"])
-    diff = difflib.unified_diff(
-      obsolete_file,
-      lasted_file,
-      fromfile=diff["obsolete_file"],
-      tofile=diff["lasted_file"]
-    )
-    diff = ''.join(diff)
-    console =  Console()
-    syntax = Syntax(diff, "diff", theme="ansi_dark", line_numbers=True, background_color=None)
-    # os.system('cls' if os.name == 'nt' else 'clear')
-    console.print(syntax)
+    import patch
+    cut = patch.Render(pairs, os.path.abspath(args.patch) if args.patch else None, args.diff_lines, args.jobs)
+    if args.patch and not ndjson:
+      print(f"{Ico.OK} Saved {Color.YELLOW}{len(pairs)}{Color.END} diffs to {Color.GREY}{args.patch}{Color.END}" + (f", {Color.ORANGE}{cut}{Color.END} of them cut" if cut else ""))
+
+  if args.watch:
+    import watch
+    args.diff, diff_tag = "", None
+    watcher = watch.Watcher([path for sy in entries for path in sy["paths"]])
+    mode = "inotify" if watcher.inotify else "polling"
+    print(f"{Ico.RUN} Watching {Color.YELLOW}{len(watcher.files) + len(watcher.folders)}{Color.END} paths {Color.GREY}({mode}, Ctrl+C to stop){Color.END}")
+    try:
+      while True:
+        changed = watcher.Wait()
+        changes = [sy for sy in entries if any(watch.Within(path, root) for root in sy["paths"] for path in changed)]
+        Update.nbr_last = 0
+        Synchronize(changes, True)
+        if ndjson: ndjson.Flush()
+        sync_engine.Save(expire)
+    except KeyboardInterrupt:
+      pass
+
+if args.serve:
+  import serve, loader
+  warm = {} # engine of the current config files and hash algorithm
+  def Warm(run:argparse.Namespace=args) -> engine.SyncEngine:
+    # Engine kept between requests, rebuilt when 'sync.json' or 'dict.ini' change
+    key = (loader.Fingerprint([f"{config}sync.json", f"{config}dict.ini"]), utils.HASH_ALGORITHM)
+    if key not in warm:
+      for old in warm.values(): old.Close()
+      warm.clear()
+      canon.Real.cache_clear() # symlinks may point elsewhere by now
+      canon.Key.cache_clear()
+      warm[key] = Load(run)
+      warm[key].Watch()
+      warm[key].Expire() # written by the next request
+    return warm[key]
+  def Request(request:dict):
+    # Run of a forwarded CLI, settings come from its arguments
+    request = argparse.Namespace(**request["args"])
+    utils.HASH_ALGORITHM = request.hash
+    metrics.ENABLED = request.stats is not None
+    metrics.Reset()
+    Sync(request, Warm(request), False)
+  Warm()
+  serve.Serve(sock, Request)
+  sys.exit(0)
+
+Sync(args, Load(args))
@@ -0,0 +1,51 @@
+import utils
+import re, hashlib, threading
+
+class Tree():
+  # Merkle tree of one folder copy: a file node is its content digest, a folder node hashes the sorted
+  # (name, kind, node) entries passing the white/black lists. Folders without such files hash as 'empty',
+  # so a missing folder equals an empty one. Nodes are computed on demand and memoized, leaves come
+  # from 'digest' (the hash cache), so after the first run only changed files are read again.
+  def __init__(self, root:str, whitelist:re.Pattern|None, blacklist:re.Pattern|None, listdir, digest):
+    self.root = root
+    self.whitelist = whitelist
+    self.blacklist = blacklist
+    self.listdir = listdir
+    self.digest = digest
+    self.nodes:dict[str, str] = {}
+    self.entries:dict[str, list[tuple[str, bool]]] = {}
+    self.empty = hashlib.new(utils.HASH_ALGORITHM).hexdigest()
+    self.lock = threading.Lock()
+
+  def Entries(self, rel:str="") -> list[tuple[str, bool]]:
+    # Sorted (name, is_dir) of the folder 'rel' (relative, ending with '/'), as walked by utils.WalkFiles
+    if rel in self.entries: return self.entries[rel]
+    try: listing = self.listdir(f"{self.root}/{rel}".rstrip("/"))
+    except (FileNotFoundError, NotADirectoryError): listing = []
+    entries = [(name, is_dir) for name, is_dir in listing
+      if not (self.blacklist and self.blacklist.match(f"{rel}{name}"))
+      and (is_dir or not self.whitelist or self.whitelist.match(f"{rel}{name}"))]
+    with self.lock: self.entries[rel] = entries
+    return entries
+
+  def Files(self, rel:str="") -> list[str]:
+    # Paths of the files passing the lists under the folder 'rel', their listings stay memoized for Node
+    files = []
+    for name, is_dir in self.Entries(rel):
+      if is_dir: files += self.Files(f"{rel}{name}/")
+      else: files.append(f"{self.root}/{rel}{name}")
+    return files
+
+  def Node(self, rel:str="") -> str:
+    # Node of the folder 'rel' (ending with '/', the root is '') or of the file 'rel'
+    with self.lock:
+      if rel in self.nodes: return self.nodes[rel]
+    if rel and not rel.endswith("/"): node = self.digest(f"{self.root}/{rel}")
+    else:
+      hasher = hashlib.new(utils.HASH_ALGORITHM)
+      for name, is_dir in self.Entries(rel):
+        node = self.Node(f"{rel}{name}/" if is_dir else f"{rel}{name}")
+        if not is_dir or node != self.empty: hasher.update(f"{name}\0{"d" if is_dir else "f"}\0{node}\n".encode())
+      node = hasher.hexdigest()
+    with self.lock: self.nodes[rel] = node
+    return node
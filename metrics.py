@@ -0,0 +1,63 @@
+import time, threading
+
+ENABLED = False
+
+phases:dict[str, list] = {} # name: [wall, cpu, calls]
+counters:dict[str, int] = {}
+libraries:dict[str, float] = {}
+lock = threading.Lock()
+
+class _Timer():
+  __slots__ = ("name", "wall", "cpu")
+
+  def __init__(self, name:str):
+    self.name = name
+
+  def __enter__(self):
+    self.wall = time.perf_counter()
+    self.cpu = time.thread_time()
+
+  def __exit__(self, *exc):
+    wall = time.perf_counter() - self.wall
+    cpu = time.thread_time() - self.cpu
+    with lock:
+      phase = phases.setdefault(self.name, [0.0, 0.0, 0])
+      phase[0] += wall
+      phase[1] += cpu
+      phase[2] += 1
+
+class _Null():
+  __slots__ = ()
+  def __enter__(self): pass
+  def __exit__(self, *exc): pass
+
+_NULL = _Null()
+
+def Phase(name:str):
+  # 'with metrics.Phase("copy"):' adds wall & CPU time of the block, a shared no-op when disabled
+  return _Timer(name) if ENABLED else _NULL
+
+def Count(name:str, value:int=1):
+  if not ENABLED: return
+  with lock: counters[name] = counters.get(name, 0) + value
+
+def Library(name:str, seconds:float):
+  if not ENABLED: return
+  with lock: libraries[name] = libraries.get(name, 0.0) + seconds
+
+def Reset():
+  # Long-lived processes (the daemon) measure every run on its own
+  with lock:
+    phases.clear()
+    counters.clear()
+    libraries.clear()
+
+def Slowest(count:int=10) -> list[tuple[str, float]]:
+  return sorted(libraries.items(), key=lambda item: item[1], reverse=True)[:count]
+
+def Summary(count:int=10) -> dict:
+  return {
+    "phases": {name: {"wall": wall, "cpu": cpu, "calls": calls} for name, (wall, cpu, calls) in phases.items()},
+    "counters": dict(counters),
+    "slowest": [{"name": name, "wall": wall} for name, wall in Slowest(count)]
+  }
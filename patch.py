@@ -0,0 +1,158 @@
+import xaeian as xn
+import os, re, sys, difflib, itertools, subprocess
+from typing import Iterator
+
+SNIFF_SIZE = 8192
+CHUNK_SIZE = 256 * 1024
+MAX_LINES = 2000 # diff lines rendered per pair, the rest is cut
+RICH_LINES = 500 # a single diff up to this size is highlighted by 'rich'
+CONTEXT = 3
+HEX_WIDTH = 16
+HUNK = re.compile(r"^@@ -(\d+)(,\d+)? \+(\d+)(,\d+)? @@")
+
+class Color(xn.Color): pass
+
+def IsBinary(path:str) -> bool:
+  # NUL byte or invalid UTF-8 in the first block (a multibyte char cut at its end doesn't count)
+  with open(path, "rb") as file:
+    block = file.read(SNIFF_SIZE)
+  if b"\0" in block: return True
+  try: block.decode("utf-8")
+  except UnicodeDecodeError as e: return e.start < len(block) - 3 or e.reason != "unexpected end of data"
+  return False
+
+def _Lines(path:str) -> list[str]:
+  with open(path, "r", encoding="utf-8", errors="replace", newline="") as file:
+    return file.read().splitlines()
+
+def TextDiff(old:str, new:str, context:int=CONTEXT) -> Iterator[str]:
+  # Unified diff of the changed middle only, the common head and tail never reach the quadratic matcher
+  a, b = _Lines(old), _Lines(new)
+  size = min(len(a), len(b))
+  head = 0
+  while head < size and a[head] == b[head]: head += 1
+  tail = 0
+  while tail < size - head and a[-1 - tail] == b[-1 - tail]: tail += 1
+  start, tail = max(0, head - context), max(0, tail - context)
+  lines = difflib.unified_diff(a[start:len(a) - tail], b[start:len(b) - tail], old, new, lineterm="")
+  for line in lines:
+    if start and (match := HUNK.match(line)):
+      # Hunk ranges are relative to the sliced middle
+      line = f"@@ -{int(match[1]) + start}{match[2] or ""} +{int(match[3]) + start}{match[4] or ""} @@{line[match.end():]}"
+    yield line
+
+def _HexRows(file, offset:int, rows:int) -> list[str]:
+  file.seek(offset)
+  data = file.read(rows * HEX_WIDTH)
+  lines = []
+  for i in range(0, len(data), HEX_WIDTH):
+    row = data[i:i + HEX_WIDTH]
+    text = "".join(chr(byte) if 32 <= byte < 127 else "." for byte in row)
+    lines.append(f"{offset + i:08x}  {row.hex(" "):<{HEX_WIDTH * 3 - 1}}  |{text}|")
+  return lines
+
+def BinaryDiff(old:str, new:str, rows:int=4) -> Iterator[str]:
+  # Sizes, differing bytes over the common length and a hex view of both files at the first difference
+  yield f"Binary files {old} and {new} differ"
+  first, changed, offset = None, 0, 0
+  with open(old, "rb") as fold, open(new, "rb") as fnew:
+    while True:
+      a, b = fold.read(CHUNK_SIZE), fnew.read(CHUNK_SIZE)
+      size = min(len(a), len(b))
+      if not size: break
+      if a[:size] != b[:size]:
+        xor = (int.from_bytes(a[:size]) ^ int.from_bytes(b[:size])).to_bytes(size)
+        changed += size - xor.count(0)
+        if first is None: first = offset + size - len(xor.lstrip(b"\0"))
+      offset += size
+    size_old, size_new = os.fstat(fold.fileno()).st_size, os.fstat(fnew.fileno()).st_size
+    yield f"size {size_old} -> {size_new} bytes, {changed} of {offset} common bytes differ"
+    if first is None: first = offset # one file is a prefix of the other
+    first -= first % HEX_WIDTH
+    yield f"@@ first difference at 0x{first:08x} @@"
+    yield from (f"-{line}" for line in _HexRows(fold, first, rows))
+    yield from (f"+{line}" for line in _HexRows(fnew, first, rows))
+
+def Pair(old:str, new:str, max_lines:int=MAX_LINES) -> tuple[bool, list[str]]:
+  # Rendered diff of one (obsolete, latest) pair, cut after 'max_lines'
+  binary = IsBinary(old) or IsBinary(new)
+  lines = list(itertools.islice(BinaryDiff(old, new) if binary else TextDiff(old, new), max_lines + 1))
+  if not lines:
+    lines = ["# files differ only in line endings or invalid UTF-8"]
+  if len(lines) > max_lines:
+    lines[max_lines:] = [f"# diff cut after {max_lines} lines, raise it with --diff-lines"]
+  return binary, lines
+
+class Pager():
+  # Writes to stdout until the text outgrows the terminal, then continues in $PAGER (default: less -R)
+  def __init__(self):
+    self.tty = sys.stdout.isatty()
+    try: self.height = os.get_terminal_size().lines - 1 if self.tty else 0
+    except OSError: self.height = 0
+    self.lines:list[str]|None = [] if self.height > 0 else None
+    self.stream = sys.stdout
+    self.process = None
+
+  def Write(self, line:str):
+    if not self.stream: return
+    if self.lines is not None:
+      self.lines.append(line)
+      if len(self.lines) <= self.height: return
+      self.process = subprocess.Popen(os.environ.get("PAGER") or "less -R", shell=True, stdin=subprocess.PIPE, text=True, encoding="utf-8")
+      self.stream = self.process.stdin
+      pending, self.lines = self.lines, None
+      for line in pending: self.Write(line)
+      return
+    try: self.stream.write(line + "\n")
+    except BrokenPipeError: self.stream = None # pager closed before the end
+
+  def Close(self):
+    for line in self.lines or []: print(line)
+    if self.process:
+      try: self.process.stdin.close()
+      except BrokenPipeError: pass
+      self.process.wait()
+
+def Colorize(line:str, header:bool=False) -> str:
+  if header: return f"{Color.GREY}{line}{Color.END}"
+  if line.startswith("+"): return f"{Color.GREEN}{line}{Color.END}"
+  if line.startswith("-"): return f"{Color.RED}{line}{Color.END}"
+  if line.startswith("@@"): return f"{Color.TEAL}{line}{Color.END}"
+  if line.startswith("#"): return f"{Color.YELLOW}{line}{Color.END}"
+  return line
+
+def Pairs(pairs:list[tuple[str, str, str, str]], max_lines:int=MAX_LINES, jobs:int|None=None) -> Iterator[tuple[bool, list[str]]]:
+  # Pair of every (tag, name, obsolete, latest), rendered in parallel and yielded in order
+  from concurrent.futures import ThreadPoolExecutor
+  with ThreadPoolExecutor(jobs) as pool:
+    yield from pool.map(lambda pair: Pair(pair[2], pair[3], max_lines), pairs)
+
+def Render(pairs:list[tuple[str, str, str, str]], output:str|None=None, max_lines:int=MAX_LINES, jobs:int|None=None) -> int:
+  # Diffs of (tag, name, obsolete, latest) pairs rendered in parallel and written in tag order,
+  # to a patch bundle file or to the terminal (paged when long). Returns the number of cut diffs.
+  cut = 0
+  rendered = Pairs(pairs, max_lines, jobs)
+  if output:
+    with open(output, "w", encoding="utf-8", newline="\n") as file:
+      for (tag, name, old, new), (binary, lines) in zip(pairs, rendered):
+        cut += lines[-1].startswith("# diff cut")
+        file.write(f"# {tag} {name}\n")
+        file.writelines(f"{line}\n" for line in lines)
+    return cut
+  if len(pairs) == 1 and sys.stdout.isatty():
+    binary, lines = next(rendered)
+    if not binary and len(lines) <= RICH_LINES:
+      from rich.console import Console
+      from rich.syntax import Syntax
+      print(f"{xn.IcoText.DOC} Difference file {Color.BLUE}{pairs[0][1]}{Color.END}, tag {Color.GREEN}{pairs[0][0]}{Color.END}:")
+      Console().print(Syntax("\n".join(lines), "diff", theme="ansi_dark", line_numbers=True, background_color=None))
+      return 0
+    rendered = iter([(binary, lines)])
+  pager = Pager()
+  for (tag, name, old, new), (binary, lines) in zip(pairs, rendered):
+    cut += lines[-1].startswith("# diff cut")
+    pager.Write(f"{xn.IcoText.DOC} Difference file {Color.BLUE}{name}{Color.END}, tag {Color.GREEN}{tag}{Color.END}:")
+    for nbr, line in enumerate(lines):
+      pager.Write(Colorize(line, nbr < 2 and not binary) if pager.tty else line)
+  pager.Close()
+  return cut
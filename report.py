@@ -0,0 +1,19 @@
+import sys, re, json
+
+ANSI = re.compile(r"\033\[[0-9;]*m")
+
+class Ndjson():
+  # One JSON record per line, written as soon as it is produced;
+  # a piped stdout is block-buffered, so many small records stay cheap
+  def __init__(self, stream=None):
+    self.stream = stream or sys.stdout
+
+  def Write(self, type:str, **record):
+    self.stream.write(json.dumps({"type": type} | record, ensure_ascii=False, separators=(",", ":")) + "\n")
+
+  def Flush(self):
+    self.stream.flush()
+
+def Plain(text:str) -> str:
+  # Message without terminal colors
+  return ANSI.sub("", text)
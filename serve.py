@@ -0,0 +1,88 @@
+import xaeian as xn
+import os, sys, json, time, socket, signal, contextlib, traceback
+
+class Ico(xn.IcoText): pass
+class Color(xn.Color): pass
+
+# Resident daemon (--serve) and its client. The CLI sends its parsed arguments as one JSON line to the
+# socket in the config folder, the daemon runs them with stdout sent back as it is written, then a NUL
+# byte and the exit code. Requests are run one by one, as from separate terminals.
+
+def Forward(path:str, request:dict) -> int|None:
+  # Exit code of the run done by the daemon, None when no daemon listens (the run is standalone then)
+  if not hasattr(socket, "AF_UNIX"): return None
+  client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  try: client.connect(path)
+  except OSError:
+    client.close()
+    return None
+  with client:
+    client.sendall(json.dumps(request).encode() + b"\n")
+    sys.stdout.flush()
+    out = sys.stdout.buffer
+    code = None
+    while chunk := client.recv(64 * 1024):
+      if code is None and b"\0" in chunk:
+        chunk, code = chunk.split(b"\0", 1)
+      elif code is not None:
+        code, chunk = code + chunk, b""
+      out.write(chunk)
+      out.flush()
+  return int(code) if code else 1 # no exit code: the daemon stopped during the run
+
+def Stop(*_):
+  raise KeyboardInterrupt
+
+def Serve(path:str, handler):
+  # Runs 'handler(request)' for every client with stdout redirected to it, until Ctrl+C or SIGTERM
+  if not hasattr(socket, "AF_UNIX"):
+    print(f"{Ico.ERR} Daemon needs Unix sockets, not available on this system")
+    sys.exit(1)
+  if os.path.exists(path):
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+      probe.connect(path)
+      print(f"{Ico.ERR} Daemon is already running on {Color.ORANGE}{path}{Color.END}")
+      sys.exit(1)
+    except OSError: os.unlink(path) # left by a daemon that was killed
+    finally: probe.close()
+  server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  try: server.bind(path)
+  except OSError as e: # e.g. a path over the ~100 bytes sockets allow
+    print(f"{Ico.ERR} Daemon can't listen on {Color.ORANGE}{path}{Color.END}: {e}")
+    sys.exit(1)
+  server.listen()
+  signal.signal(signal.SIGTERM, Stop)
+  print(f"{Ico.RUN} Serving on {Color.GREY}{path}{Color.END} {Color.GREY}(Ctrl+C to stop){Color.END}")
+  try:
+    while True:
+      conn, _ = server.accept()
+      with conn: Handle(conn, handler)
+  except KeyboardInterrupt:
+    pass
+  finally:
+    server.close()
+    os.unlink(path)
+
+def Handle(conn:socket.socket, handler):
+  start = time.perf_counter()
+  with conn.makefile("rb") as reader:
+    try: request = json.loads(reader.readline())
+    except ValueError: return
+  stream = conn.makefile("w", encoding="utf-8", newline="\n")
+  code = 0
+  try:
+    with contextlib.redirect_stdout(stream):
+      try: handler(request)
+      except SystemExit as e: code = e.code if isinstance(e.code, int) else int(e.code is not None)
+      except Exception:
+        traceback.print_exc(file=stream)
+        code = 1
+    stream.write(f"\0{code}")
+    stream.flush()
+  except OSError: # client gone, its run is done anyway
+    code = None
+  finally:
+    with contextlib.suppress(OSError): stream.close()
+  ico = Ico.OK if code == 0 else Ico.ERR
+  print(f"{ico} {" ".join(request.get("argv", []))} {Color.GREY}{(time.perf_counter() - start) * 1000:.1f} ms{Color.END}")
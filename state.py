@@ -0,0 +1,82 @@
+import xaeian as xn, utils
+import os, json, sqlite3, threading
+
+class State():
+  # Last successful sync of every library path and cached folder listings, kept in SQLite.
+  # Tables are loaded once per run and written back in a single transaction by Save.
+  def __init__(self, path:str="state.db"):
+    self.path = xn.FixPath(path)
+    self.db = sqlite3.connect(self.path, check_same_thread=False)
+    self.db.execute("CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, dev INTEGER, ino INTEGER, size INTEGER, mtime_ns INTEGER, digest TEXT)")
+    self.db.execute("CREATE TABLE IF NOT EXISTS dirs (path TEXT PRIMARY KEY, mtime_ns INTEGER, listing TEXT)")
+    if self.Algorithm() != utils.HASH_ALGORITHM: # digests of another algorithm can't be compared
+      with self.db: self.db.execute("DELETE FROM files")
+    self.files = {row[0]: row[1:] for row in self.db.execute("SELECT * FROM files")}
+    self.dirs = {row[0]: (row[1], json.loads(row[2])) for row in self.db.execute("SELECT * FROM dirs")}
+    self.changed_files:set[str] = set()
+    self.changed_dirs:set[str] = set()
+    self.skipped = 0
+    self.listings = 0
+    self.lock = threading.Lock()
+
+  @staticmethod
+  def Identity(stat:os.stat_result) -> tuple:
+    return (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+  def Synced(self, paths:list[str], stats:list[os.stat_result]) -> str|None:
+    # Digest shared by all paths when none of them changed since they were last synced together
+    digests = set()
+    for path, stat in zip(paths, stats):
+      entry = self.files.get(path)
+      if not entry or entry[:4] != self.Identity(stat): return None
+      digests.add(entry[4])
+    if len(digests) != 1: return None
+    with self.lock: self.skipped += 1
+    return digests.pop()
+
+  def Algorithm(self) -> str:
+    row = self.db.execute("PRAGMA user_version").fetchone()
+    return utils.HASH_ALGORITHMS[row[0] - 1] if 0 < row[0] <= len(utils.HASH_ALGORITHMS) else ""
+
+  def Classify(self, paths:list[str], stats:list[os.stat_result], digests:list[str|None]) -> list[str]:
+    # 'unchanged', 'modified' or 'new' relative to the last sync of each path
+    states = []
+    for path, stat, digest in zip(paths, stats, digests):
+      entry = self.files.get(path)
+      if not entry: states.append("new")
+      elif entry[:4] == self.Identity(stat) or (digest and digest == entry[4]): states.append("unchanged")
+      else: states.append("modified")
+    return states
+
+  def Record(self, path:str, stat:os.stat_result, digest:str):
+    with self.lock:
+      self.files[path] = self.Identity(stat) + (digest,)
+      self.changed_files.add(path)
+
+  def ListDir(self, path:str) -> list[tuple[str, bool]]:
+    # Listing is reused while the folder mtime is unchanged (entries added, removed or renamed)
+    mtime = os.stat(path).st_mtime_ns
+    entry = self.dirs.get(path)
+    if entry and entry[0] == mtime:
+      return [tuple(item) for item in entry[1]]
+    listing = utils.ListDir(path)
+    with self.lock:
+      self.listings += 1
+      self.dirs[path] = (mtime, listing)
+      self.changed_dirs.add(path)
+    return listing
+
+  def Expire(self, roots:list[str]):
+    roots = utils.RootSet(roots)
+    for table, entries in (("files", self.files), ("dirs", self.dirs)):
+      stale = [path for path in entries if not utils.InRoots(path, roots)]
+      for path in stale: del entries[path]
+      self.db.executemany(f"DELETE FROM {table} WHERE path = ?", [(path,) for path in stale])
+
+  def Save(self):
+    with self.db:
+      self.db.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)", [(path, *self.files[path]) for path in self.changed_files if path in self.files])
+      self.db.executemany("INSERT OR REPLACE INTO dirs VALUES (?, ?, ?)", [(path, self.dirs[path][0], json.dumps(self.dirs[path][1])) for path in self.changed_dirs if path in self.dirs])
+      self.db.execute(f"PRAGMA user_version = {utils.HASH_ALGORITHMS.index(utils.HASH_ALGORITHM) + 1}")
+    self.changed_files.clear()
+    self.changed_dirs.clear()
@@ -1,43 +1,333 @@
-import pathlib, hashlib, shutil
-from datetime import datetime
-import xaeian as xn
+import os, re, stat as st, hashlib, contextlib, threading, fnmatch
+import xaeian as xn, metrics, canon
+try: import fcntl
+except ImportError: fcntl = None
 
-SEP = "@"
+HASH_ALGORITHMS = ["md5", "sha1", "sha256", "blake2b", "blake2s"]
+HASH_ALGORITHM = "sha1"
+CHUNK_SIZE = 256 * 1024
+SAMPLE_SIZE = 4096
+FICLONE = 0x40049409
+DELTA_SIZE = 4 * 1024 * 1024 # from 'bench.py delta': smaller files are copied and backed up whole
 
-def HashFile(path:str):
-  hasher = hashlib.md5()
+def HashFile(path:str, algorithm:str|None=None) -> str:
+  algorithm = algorithm or HASH_ALGORITHM
   with open(path, "rb") as file:
-    buf = file.read()
-    hasher.update(buf)
+    if metrics.ENABLED:
+      metrics.Count("files_hashed")
+      metrics.Count("bytes_hashed", os.fstat(file.fileno()).st_size)
+    if hasattr(hashlib, "file_digest"):
+      return hashlib.file_digest(file, algorithm).hexdigest()
+    hasher = hashlib.new(algorithm)
+    buffer = bytearray(CHUNK_SIZE)
+    view = memoryview(buffer)
+    while size := file.readinto(buffer):
+      hasher.update(view[:size])
   return hasher.hexdigest()
 
-def OverwriteFile(src:str, dsc:str):
+class StatSnapshot():
+  # One os.stat per path and run, every later lookup is served from memory
+  def __init__(self):
+    self.stats:dict[str, os.stat_result|None] = {}
+    self.calls = 0
+    self.syscalls = 0
+    self.lock = threading.Lock()
+
+  def Stat(self, path:str) -> os.stat_result|None:
+    with self.lock:
+      self.calls += 1
+      if path in self.stats: return self.stats[path]
+    try: stat = os.stat(path)
+    except OSError: stat = None
+    with self.lock:
+      self.syscalls += 1
+      self.stats[path] = stat
+    return stat
+
+  def IsFile(self, path:str) -> bool:
+    stat = self.Stat(path)
+    return bool(stat and st.S_ISREG(stat.st_mode))
+
+  def IsDir(self, path:str) -> bool:
+    stat = self.Stat(path)
+    return bool(stat and st.S_ISDIR(stat.st_mode))
+
+  def Invalidate(self, path:str):
+    with self.lock: self.stats.pop(path, None)
+
+  @property
+  def saved(self) -> int:
+    return self.calls - self.syscalls
+
+def RootSet(roots:list[str]) -> set[str]:
+  return {root.rstrip("/") or "/" for root in roots}
+
+def InRoots(path:str, roots:set[str]) -> bool:
+  # Path is one of the roots or lies in one: its ancestors are looked up in the set, O(depth) per path
+  while path not in roots:
+    parent = os.path.dirname(path)
+    if parent == path: return False
+    path = parent
+  return True
+
+class HashCache():
+  # Digests persisted next to 'sync.json', valid while the stat identity of the path is unchanged
+  def __init__(self, path:str="cache.json"):
+    self.path = xn.FixPath(path)
+    self.entries:dict[str, list] = xn.JSON.Load(self.path, {})
+    self.hits = 0
+    self.misses = 0
+    self.identities:dict[str, list] = {}
+    self.physical:dict[tuple, str] = {}
+    self.changed = False # written back by Save only when entries were added or dropped
+    self.lock = threading.Lock()
+
+  def Get(self, path:str, stat:os.stat_result|None=None) -> str|None:
+    stat = stat or os.stat(path)
+    identity = [stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns, HASH_ALGORITHM]
+    with self.lock:
+      self.identities[path] = identity
+      entry = self.entries.get(path)
+      if entry and entry[:5] == identity:
+        self.hits += 1
+        return entry[5]
+      # Same physical file already hashed this run under another path (hard link, shared folder)
+      digest = self.physical.get(tuple(identity))
+      if digest: self.hits += 1
+      else: self.misses += 1
+      return digest
+
+  def Set(self, path:str, digest:str):
+    # Stored under the identity seen by Get, so a file changed meanwhile is a miss next run
+    with self.lock:
+      identity = self.identities.get(path)
+      if not identity: return
+      entry = identity + [digest]
+      if self.entries.get(path) != entry: self.changed = True
+      self.entries[path] = entry
+      self.physical[tuple(identity)] = digest
+
+  def Expire(self, roots:list[str]):
+    roots = RootSet(roots)
+    entries = {path: entry for path, entry in self.entries.items() if InRoots(path, roots)}
+    if len(entries) != len(self.entries): self.changed = True
+    self.entries = entries
+
+  def Save(self):
+    if not self.changed: return
+    xn.JSON.Save(self.path, self.entries)
+    self.changed = False
+
+def _Lockstep(group:list[int], files:dict, digests:list, hasher) -> list[list[int]]:
+  while len(group) > 1:
+    chunks:dict[bytes, list[int]] = {}
+    for i in group:
+      chunks.setdefault(files[i].read(CHUNK_SIZE), []).append(i)
+    if metrics.ENABLED:
+      metrics.Count("bytes_read", sum(len(chunk) * len(subgroup) for chunk, subgroup in chunks.items()))
+    if len(chunks) > 1:
+      classes = []
+      for chunk, subgroup in chunks.items():
+        subhasher = hasher.copy()
+        subhasher.update(chunk)
+        metrics.Count("bytes_hashed", len(chunk))
+        classes += _Lockstep(subgroup, files, digests, subhasher)
+      return classes
+    chunk = next(iter(chunks))
+    if not chunk:
+      digest = hasher.hexdigest()
+      metrics.Count("files_hashed", len(group))
+      for i in group: digests[i] = digests[i] or digest
+      break
+    hasher.update(chunk)
+    metrics.Count("bytes_hashed", len(chunk))
+  return [group]
+
+def CompareFiles(paths:list[str], digests:list[str|None]|None=None, stats:list[os.stat_result]|None=None) -> tuple[list[int], list[str|None]]:
+  # Groups equal files by size, then head/tail samples, then chunks read in lockstep until they diverge.
+  # Known digests stand in for their files, digests of classes read to the end come for free.
+  digests = list(digests) if digests else [None] * len(paths)
+  link = list(range(len(paths)))
+  known:dict[str, int] = {}
+  inodes:dict[tuple, int] = {}
+  by_size:dict[int, list[int]] = {}
+  for i, digest in enumerate(digests):
+    if digest is not None:
+      if digest in known:
+        link[i] = known[digest]
+        continue
+      known[digest] = i
+    stat = stats[i] if stats else os.stat(paths[i])
+    inode = canon.Identity(stat)
+    if inode in inodes:
+      link[i] = inodes[inode]
+      continue
+    inodes[inode] = i
+    by_size.setdefault(stat.st_size, []).append(i)
+  classes = []
+  for size, members in by_size.items():
+    if len(members) == 1:
+      classes.append(members)
+      continue
+    with contextlib.ExitStack() as stack:
+      files = {i: stack.enter_context(open(paths[i], "rb")) for i in members}
+      samples:dict[tuple, list[int]] = {}
+      if size > 2 * SAMPLE_SIZE:
+        for i in members:
+          head = files[i].read(SAMPLE_SIZE)
+          files[i].seek(-SAMPLE_SIZE, os.SEEK_END)
+          samples.setdefault((head, files[i].read(SAMPLE_SIZE)), []).append(i)
+          metrics.Count("bytes_read", 2 * SAMPLE_SIZE)
+          files[i].seek(0)
+      else: samples[()] = members
+      for group in samples.values():
+        classes += _Lockstep(group, files, digests, hashlib.new(HASH_ALGORITHM))
+  owner = [0] * len(paths)
+  for nbr, members in enumerate(classes):
+    for i in members: owner[i] = nbr
+  groups, order = [], {}
+  for i in range(len(paths)):
+    groups.append(order.setdefault(owner[link[i]], len(order)))
+    digests[i] = digests[i] or digests[link[i]]
+  return groups, digests
+
+def CopyData(src_fd:int, dst_fd:int, size:int) -> str:
+  # Fastest available copy: reflink clone, copy_file_range, sendfile, then a user space loop
+  if fcntl:
+    try:
+      fcntl.ioctl(dst_fd, FICLONE, src_fd)
+      return "reflink"
+    except OSError: pass
+  offset = 0
+  if hasattr(os, "copy_file_range"):
+    try:
+      while offset < size and (sent := os.copy_file_range(src_fd, dst_fd, size - offset)):
+        offset += sent
+      if offset >= size: return "copy_file_range"
+    except OSError: pass
+  if hasattr(os, "sendfile"):
+    try:
+      os.lseek(dst_fd, offset, os.SEEK_SET)
+      while offset < size and (sent := os.sendfile(dst_fd, src_fd, offset, size - offset)):
+        offset += sent
+      if offset >= size: return "sendfile"
+    except OSError: pass
+  os.lseek(src_fd, offset, os.SEEK_SET)
+  os.lseek(dst_fd, offset, os.SEEK_SET)
+  while chunk := os.read(src_fd, CHUNK_SIZE):
+    os.write(dst_fd, chunk)
+  return "read"
+
+def PatchFile(src:str, dsc:str) -> int|None:
+  # Rewrites in place only the chunks of 'dsc' that differ from 'src' and returns the bytes written.
+  # None leaves 'dsc' untouched: missing, not a regular file or hard linked (the other names would change too).
+  try: fdst = open(dsc, "r+b", buffering=0)
+  except OSError: return None
+  with fdst, open(src, "rb") as fsrc:
+    stat = os.fstat(fdst.fileno())
+    if not st.S_ISREG(stat.st_mode) or stat.st_nlink > 1: return None
+    offset = written = 0
+    while chunk := fsrc.read(CHUNK_SIZE):
+      if fdst.read(len(chunk)) != chunk:
+        fdst.seek(offset)
+        fdst.write(chunk)
+        written += len(chunk)
+      offset += len(chunk)
+      fdst.seek(offset)
+    fdst.truncate(offset)
+    os.fsync(fdst.fileno())
+  return written
+
+def OverwriteFile(src:str, dsc:str) -> bool:
+  # Copies into a temporary file next to the destination, then replaces it atomically,
+  # the source mtime is kept so the next run still sees the same latest copy.
+  # A symlinked destination is updated at its target, a hard linked one is written in place
+  # (a new inode would detach its other names), both like the plain copy did.
+  # Large files of unchanged length are patched in place instead (aligned chunks only match when nothing
+  # was inserted or removed), their old content is in the backup store and the journal restores a torn one.
+  dsc = os.path.realpath(dsc)
+  tmp = f"{dsc}.lipysync"
   try:
-    shutil.copyfile(src, dsc)
+    stat = os.stat(src)
+    try: dst_stat = os.stat(dsc)
+    except FileNotFoundError: dst_stat = None
+    if dst_stat and stat.st_size >= DELTA_SIZE and dst_stat.st_size == stat.st_size and (written := PatchFile(src, dsc)) is not None:
+      metrics.Count("bytes_patched", written)
+      os.utime(dsc, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+      return True
+    linked = bool(dst_stat and dst_stat.st_nlink > 1)
+    with open(src, "rb") as fsrc, open(dsc if linked else tmp, "wb") as fdst:
+      CopyData(fsrc.fileno(), fdst.fileno(), stat.st_size)
+      os.fsync(fdst.fileno())
+    if linked:
+      os.utime(dsc, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+      return True
+    # Plain chmod, 'shutil' would pull in its archive codecs at startup
+    if dst_stat: os.chmod(tmp, st.S_IMODE(dst_stat.st_mode))
+    os.utime(tmp, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    os.replace(tmp, dsc)
     return True
-  except FileNotFoundError: return False
-  except Exception as e: return False
-
-def BackupFile(src:str, name:str, backup_path:str="./backups"):
-  backup_path = xn.FixPath(backup_path)
-  path = f"{backup_path}/{datetime.now().strftime(f"%Y-%m-%d{SEP}%H-%M-%S")}"
-  pathlib.Path(path).mkdir(parents=True, exist_ok=True)
-  shutil.copyfile(src, f"{path}/{name}")
-
-def FileList(path: str):
-  fpath = pathlib.Path(path)
-  if not fpath.exists():
-    raise FileNotFoundError(f"Folder {xn.Color.ORANGE}{path}{xn.Color.END} doesn't exist")
-  if not fpath.is_dir():
-    raise NotADirectoryError(f"{xn.Color.ORANGE}{path}{xn.Color.END} isn't directory")
-  return [file.name for file in fpath.iterdir() if file.is_file()]
+  except OSError:
+    with contextlib.suppress(OSError): os.remove(tmp)
+    return False
 
-def IntersectionList(lists: list[list]) -> set:
-  if not lists:
-    return []
-  return list(set(lists[0]).intersection(*lists[1:]))
+def SyncDirs(paths) -> int:
+  # One fsync per distinct folder makes the renames inside it durable,
+  # folders that can't be opened for it (Windows) are skipped
+  count = 0
+  for path in set(paths):
+    try: fd = os.open(path or ".", os.O_RDONLY)
+    except OSError: continue
+    try:
+      os.fsync(fd)
+      count += 1
+    except OSError: pass
+    finally: os.close(fd)
+  metrics.Count("dirs_synced", count)
+  return count
 
-def UnionList(lists: list[list]) -> list:
-  if not lists:
-    return []
-  return list(set().union(*lists))
+def CompileGlobs(patterns:list[str]|None) -> re.Pattern|None:
+  # Patterns without '/' match a name at any depth, the others match the path relative to the folder
+  if not patterns: return None
+  regexs = []
+  for pattern in patterns:
+    regex = fnmatch.translate(pattern.strip("/"))
+    regexs.append(regex if "/" in pattern.strip("/") else f"(?:.*/)?{regex}")
+  return re.compile("|".join(regexs))
+
+def ListDir(path:str) -> list[tuple[str, bool]]:
+  # Sorted (name, is_dir) of files and folders, DirEntry type data avoids a stat per entry.
+  # Symlinked folders are followed, except those leading back to a folder above (a loop).
+  listing = []
+  with os.scandir(path) as entries:
+    for entry in entries:
+      if entry.is_dir():
+        if not (entry.is_symlink() and _Loop(path, entry.path)): listing.append((entry.name, True))
+      elif entry.is_file(): listing.append((entry.name, False))
+  return sorted(listing)
+
+def _Loop(path:str, link:str) -> bool:
+  # Link target is the folder 'path' itself or one of its parents, as reached through the walk
+  target = os.path.realpath(link)
+  while True:
+    if os.path.realpath(path) == target: return True
+    parent = os.path.dirname(path)
+    if parent == path: return False
+    path = parent
+
+def WalkFiles(path:str, whitelist:re.Pattern|None=None, blacklist:re.Pattern|None=None, base:str="", listdir=ListDir):
+  # Yields relative file paths in tree order, blacklisted folders are not entered
+  for entry, is_dir in listdir(path):
+    name = f"{base}{entry}"
+    if blacklist and blacklist.match(name): continue
+    if is_dir:
+      yield from WalkFiles(f"{path}/{entry}", whitelist, blacklist, f"{name}/", listdir)
+    elif not whitelist or whitelist.match(name):
+      yield name
+
+def FileList(path:str, whitelist:re.Pattern|None=None, blacklist:re.Pattern|None=None, listdir=ListDir):
+  if not os.path.exists(path):
+    raise FileNotFoundError(f"Folder {xn.Color.ORANGE}{path}{xn.Color.END} doesn't exist")
+  if not os.path.isdir(path):
+    raise NotADirectoryError(f"{xn.Color.ORANGE}{path}{xn.Color.END} isn't directory")
+  return WalkFiles(path, whitelist, blacklist, listdir=listdir)
@@ -0,0 +1,106 @@
+import os, sys, time, select, struct, ctypes, ctypes.util
+
+DEBOUNCE = 0.25 # quiet time that closes a burst of events
+LATENCY = 0.75 # longest time a burst can be delayed
+POLL_INTERVAL = 1.0
+
+IN_ATTRIB = 0x00000004 # mtime set without a write (touch, restored backups)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+IN_MASK = IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+EVENT = struct.Struct("iIII")
+
+def Within(path:str, root:str) -> bool:
+  return path == root or path.startswith(f"{root}/")
+
+class Inotify():
+  def __init__(self):
+    if not sys.platform.startswith("linux"):
+      raise OSError("inotify is only available on Linux")
+    self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    if self.fd < 0:
+      raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+    self.dirs:dict[int, str] = {}
+    self.failed = 0 # folders left unwatched (e.g. max_user_watches reached), their changes go unnoticed
+
+  def Add(self, path:str):
+    wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), IN_MASK)
+    if wd >= 0: self.dirs[wd] = path
+    else: self.failed += 1
+
+  def Read(self) -> set[str]:
+    # Paths touched by pending events, None marks a queue overflow
+    paths = set()
+    try: data = os.read(self.fd, 64 * 1024)
+    except BlockingIOError: return paths
+    offset = 0
+    while offset < len(data):
+      wd, mask, _, size = EVENT.unpack_from(data, offset)
+      name = data[offset + EVENT.size:offset + EVENT.size + size].rstrip(b"\0")
+      offset += EVENT.size + size
+      if mask & IN_Q_OVERFLOW:
+        paths.add(None)
+        continue
+      if wd not in self.dirs: continue
+      path = f"{self.dirs[wd]}/{os.fsdecode(name)}" if name else self.dirs[wd]
+      if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+        for root, _, _ in os.walk(path): self.Add(root.replace("\\", "/"))
+      paths.add(path)
+    return paths
+
+class Watcher():
+  def __init__(self, roots:list[str]):
+    self.files = {root for root in roots if os.path.isfile(root)}
+    self.folders = [root for root in roots if os.path.isdir(root)]
+    try:
+      self.inotify = Inotify()
+      for folder in {os.path.dirname(file) for file in self.files}: self.inotify.Add(folder)
+      for folder in self.folders:
+        for root, _, _ in os.walk(folder): self.inotify.Add(root.replace("\\", "/"))
+    except (OSError, AttributeError):
+      self.inotify = None
+      self.stamps = self.Poll()
+
+  def Match(self, path:str) -> bool:
+    return path in self.files or any(Within(path, folder) for folder in self.folders)
+
+  def Poll(self) -> dict[str, tuple]:
+    stamps = {}
+    paths = list(self.files)
+    for folder in self.folders:
+      for root, _, files in os.walk(folder):
+        paths += [f"{root}/{file}".replace("\\", "/") for file in files]
+    for path in paths:
+      try: stat = os.stat(path)
+      except OSError: continue
+      stamps[path] = (stat.st_mtime_ns, stat.st_size)
+    return stamps
+
+  def Wait(self) -> set[str]:
+    # Blocks until watched files change, then collects the whole burst
+    if not self.inotify:
+      while True:
+        time.sleep(POLL_INTERVAL)
+        stamps = self.Poll()
+        changed = {path for path in stamps.keys() | self.stamps.keys() if stamps.get(path) != self.stamps.get(path)}
+        self.stamps = stamps
+        if changed: return changed
+    changed = set()
+    while not changed:
+      select.select([self.inotify.fd], [], [])
+      changed = self.inotify.Read()
+      changed = {path for path in changed if path is None or self.Match(path)}
+    deadline = time.monotonic() + LATENCY
+    while (timeout := min(DEBOUNCE, deadline - time.monotonic())) > 0:
+      if not select.select([self.inotify.fd], [], [], timeout)[0]: break
+      changed |= {path for path in self.inotify.Read() if path is None or self.Match(path)}
+    if None in changed: # overflow, everything may have changed
+      return self.files | set(self.folders)
+    return changed
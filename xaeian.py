@@ -1,4 +1,4 @@
-import os, sys, re, csv, json
+import os, sys, re, json
 from typing import Iterable, Any
 
 #------------------------------------------------------------------------------ Files
@@ -200,6 +200,7 @@ class CSV:
     path = path.removesuffix(".csv") + ".csv"
     path = FixPath(path, fix, onefile_pack)
     if not os.path.exists(path): return []
+    import csv
     try:
       with open(path, "r", encoding="utf-8") as file:
         reader = csv.DictReader(file, delimiter=delimiter)
@@ -225,6 +226,7 @@ class CSV:
     path = path.removesuffix(".csv") + ".csv"
     path = FixPath(path, fix)
     file_exists = os.path.isfile(path)
+    import csv
     with open(path, "a", newline="", encoding="utf-8") as csv_file:
       if isinstance(datarow, dict):
         field_names = list(datarow.keys())
@@ -242,6 +244,7 @@ class CSV:
   def Save(path:str,data:list[dict]|list[list],field_names:list=None, fix:bool|None=None):
     path = path.removesuffix(".csv") + ".csv"
     path = FixPath(path, fix)
+    import csv
     with open(path, "w", newline="", encoding="utf-8") as csv_file:
       if all(isinstance(row, dict) for row in data):
         field_names = field_names or list(data[0].keys())